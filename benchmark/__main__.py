@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from importlib import metadata
+
+from pyhtmltopdf import AHTMLToPDFConverter, HTMLToPDFConverter, ProcessPoolConverter
+from pyhtmltopdf import _browser_memory_usage
+from .fixtures import generate_fixtures
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+API_NAMES = ("from_file", "from_url", "from_string")
+
+
+class MemorySampler:
+    # Polls the memory usage of all browser processes on a background thread
+    # and remembers the highest value seen
+    def __init__(self, interval=0.05):
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self.peak = None
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            memory = _browser_memory_usage()
+            if memory is not None:
+                self.peak = max(self.peak or 0, memory)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _start_server(directory):
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(_QuietHandler, directory=directory)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _summarize(samples):
+    return {
+        "samples": len(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": _percentile(samples, 50),
+        "p99": _percentile(samples, 99),
+    }
+
+
+def _python_peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.time(),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "playwright": metadata.version("playwright"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def bench_launch(launch_options, launches):
+    samples = []
+    for i in range(launches):
+        converter = HTMLToPDFConverter(launch_options)
+        start = time.perf_counter()
+        converter.init()
+        samples.append(time.perf_counter() - start)
+        converter.finish()
+    return _summarize(samples)
+
+
+def bench_latency(launch_options, fixtures, directory, base_url, iterations):
+    results = {}
+    with HTMLToPDFConverter(launch_options) as converter:
+        for name, file_name in fixtures.items():
+            path = os.path.join(directory, file_name)
+            with open(path, encoding="utf-8") as f:
+                string = f.read()
+            calls = {
+                "from_file": lambda: converter.from_file(path),
+                "from_url": lambda: converter.from_url(base_url + file_name),
+                "from_string": lambda: converter.from_string(string, base_url=base_url),
+            }
+
+            results[name] = {}
+            for api in API_NAMES:
+                # The first render of each kind warms up the browser caches
+                calls[api]()
+                samples = []
+                for i in range(iterations):
+                    start = time.perf_counter()
+                    calls[api]()
+                    samples.append(time.perf_counter() - start)
+                results[name][api] = _summarize(samples)
+            print(
+                f"latency {name}: "
+                + ", ".join(
+                    f"{api} p50 {results[name][api]['p50'] * 1000:.0f}ms"
+                    for api in API_NAMES
+                ),
+                file=sys.stderr,
+            )
+    return results
+
+
+def _check_results(results):
+    for result in results:
+        if not result.ok:
+            raise RuntimeError(f"Job {result.index} failed") from result.error
+
+
+def _bench_sync(launch_options, jobs, concurrency):
+    if concurrency == 1:
+        with HTMLToPDFConverter(launch_options, page_pool_size=1) as converter:
+            start = time.perf_counter()
+            for job in jobs:
+                converter.from_file(job["file_path"])
+            return time.perf_counter() - start
+
+    with ProcessPoolConverter(
+        workers=concurrency, launch_options=launch_options, page_pool_size=1
+    ) as converter:
+        start = time.perf_counter()
+        _check_results(converter.render_many(jobs))
+        return time.perf_counter() - start
+
+
+async def _bench_async(launch_options, jobs, concurrency):
+    async with AHTMLToPDFConverter(
+        launch_options, page_pool_size=concurrency
+    ) as converter:
+        start = time.perf_counter()
+        _check_results(
+            [
+                result
+                async for result in converter.render_many(jobs, concurrency=concurrency)
+            ]
+        )
+        return time.perf_counter() - start
+
+
+def bench_throughput(launch_options, path, documents, concurrency_levels):
+    jobs = [{"file_path": path} for i in range(documents)]
+    results = {"sync": {}, "async": {}}
+    for mode in results:
+        for concurrency in concurrency_levels:
+            with MemorySampler() as memory:
+                if mode == "sync":
+                    seconds = _bench_sync(launch_options, jobs, concurrency)
+                else:
+                    seconds = asyncio.run(
+                        _bench_async(launch_options, jobs, concurrency)
+                    )
+            results[mode][str(concurrency)] = {
+                "documents": documents,
+                "seconds": seconds,
+                "documents_per_second": documents / seconds,
+                "browser_peak_rss": memory.peak,
+            }
+            print(
+                f"throughput {mode} x{concurrency}: "
+                f"{documents / seconds:.1f} documents/s",
+                file=sys.stderr,
+            )
+    return results
+
+
+def compare(baseline, results):
+    # Describes the change of every latency and throughput figure relative to a
+    # previous run. Latencies going up and throughput going down are bad.
+    lines = []
+    for name, apis in results["latency"].items():
+        for api, summary in apis.items():
+            old = baseline.get("latency", {}).get(name, {}).get(api)
+            if old:
+                change = summary["p50"] / old["p50"] - 1
+                lines.append(f"latency {name} {api} p50: {change:+.1%}")
+    for mode, levels in results["throughput"].items():
+        for concurrency, summary in levels.items():
+            old = baseline.get("throughput", {}).get(mode, {}).get(concurrency)
+            if old:
+                change = summary["documents_per_second"] / old["documents_per_second"]
+                lines.append(f"throughput {mode} x{concurrency}: {change - 1:+.1%}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Offline benchmarks for pyhtmltopdf",
+    )
+    parser.add_argument("-o", "--output", default="benchmark-results.json")
+    parser.add_argument(
+        "--fixtures",
+        default="tiny,medium,large",
+        help="comma separated fixtures to measure the latency of",
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--launches", type=int, default=5)
+    parser.add_argument(
+        "--concurrency",
+        default="1,4,8",
+        help="comma separated concurrency levels to measure the throughput at",
+    )
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--throughput-fixture", default="medium")
+    parser.add_argument(
+        "--compare", metavar="BASELINE", help="results of a previous run"
+    )
+    args = parser.parse_args(argv)
+
+    launch_options = {"executable_path": os.environ.get("CHROMIUM")}
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = generate_fixtures(directory)
+        selected = {name: fixtures[name] for name in args.fixtures.split(",")}
+        server, base_url = _start_server(directory)
+        try:
+            with MemorySampler() as memory:
+                results = {
+                    "metadata": _metadata(),
+                    "launch": bench_launch(launch_options, args.launches),
+                    "latency": bench_latency(
+                        launch_options, selected, directory, base_url, args.iterations
+                    ),
+                }
+            results["throughput"] = bench_throughput(
+                launch_options,
+                os.path.join(directory, fixtures[args.throughput_fixture]),
+                args.documents,
+                concurrency_levels,
+            )
+        finally:
+            server.shutdown()
+
+    results["memory"] = {
+        "python_peak_rss": _python_peak_rss(),
+        "browser_peak_rss": max(
+            [memory.peak or 0]
+            + [
+                level["browser_peak_rss"] or 0
+                for levels in results["throughput"].values()
+                for level in levels.values()
+            ]
+        )
+        or None,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import struct
+import zlib
+
+ROWS_PER_PAGE = 40
+
+FONT_DIRECTORIES = (
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+    "/System/Library/Fonts",
+    "C:\\Windows\\Fonts",
+)
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+{font_face}
+body {{ font-family: {font_family}; font-size: 10pt; }}
+table {{ width: 100%; border-collapse: collapse; }}
+th, td {{ border: 1px solid #999; padding: 2px 4px; }}
+tr:nth-child(even) {{ background: #eee; }}
+img {{ width: 48px; height: 48px; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def _png(width, height):
+    # A small gradient, so the image data doesn't compress down to nothing
+    raw = b"".join(
+        b"\x00"
+        + b"".join(
+            bytes((x * 255 // width, y * 255 // height, (x ^ y) & 255))
+            for x in range(width)
+        )
+        for y in range(height)
+    )
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _find_font():
+    for directory in FONT_DIRECTORIES:
+        for extension in ("woff2", "woff", "ttf", "otf"):
+            fonts = sorted(
+                glob.glob(
+                    os.path.join(directory, "**", f"*.{extension}"), recursive=True
+                )
+            )
+            if fonts:
+                return fonts[0]
+    return None
+
+
+def _table(rows, with_images):
+    lines = ["<table>", "<tr><th>#</th><th>Item</th><th>Description</th>"]
+    lines[-1] += "<th>Image</th></tr>" if with_images else "<th>Amount</th></tr>"
+    for row in range(rows):
+        last = (
+            '<td><img src="image.png"></td>'
+            if with_images
+            else f"<td>{row * 1.5:.2f}</td>"
+        )
+        lines.append(
+            f"<tr><td>{row}</td><td>Item {row}</td>"
+            f"<td>Some example text for row {row} of the table</td>{last}</tr>"
+        )
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+def _document(title, pages, font_family, font_face):
+    if pages == 0:
+        body = "<p>Some example text</p>"
+    else:
+        # Every tenth page gets images instead of amounts
+        body = "\n".join(
+            _table(ROWS_PER_PAGE, with_images=page % 10 == 0) for page in range(pages)
+        )
+    return PAGE_TEMPLATE.format(
+        title=title, body=body, font_family=font_family, font_face=font_face
+    )
+
+
+def generate_fixtures(directory):
+    # Writes the benchmark documents into directory and returns a dict of
+    # fixture name to file name. The documents only reference files next to
+    # them, so they render without network access.
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "image.png"), "wb") as f:
+        f.write(_png(64, 64))
+
+    font = _find_font()
+    if font is not None:
+        font_file = "font" + os.path.splitext(font)[1]
+        shutil.copyfile(font, os.path.join(directory, font_file))
+        font_face = (
+            f'@font-face {{ font-family: "Benchmark"; src: url("{font_file}"); }}'
+        )
+        font_family = '"Benchmark", sans-serif'
+    else:
+        font_face = ""
+        font_family = "sans-serif"
+
+    fixtures = {}
+    for name, pages in (("tiny", 0), ("medium", 10), ("large", 500)):
+        file_name = f"{name}.html"
+        with open(os.path.join(directory, file_name), "w", encoding="utf-8") as f:
+            f.write(_document(f"Benchmark {name}", pages, font_family, font_face))
+        fixtures[name] = file_name
+    return fixtures
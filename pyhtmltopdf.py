@@ -1,8 +1,36 @@
+import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import fnmatch
+import functools
+import hashlib
+import http
+import inspect
+import io
+import itertools
+import json
+import mimetypes
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import re
+import sys
 import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
 from os.path import realpath
 from playwright.sync_api import sync_playwright
 from playwright.async_api import async_playwright
-import playwright
+from playwright.async_api import Error as PlaywrightError
 
 DEFAULT_LAUNCH_OPTIONS = {
     "headless": True,
@@ -13,28 +41,3545 @@ DEFAULT_LAUNCH_OPTIONS = {
 }
 
 
+DEFAULT_LOAD_OPTIONS = {
+    "wait_until": "load",
+}
+
+# The ways to get hold of a browser, see _split_endpoint
+ENDPOINT_KINDS = ("launch", "connect", "connect_over_cdp")
+
+# Load options for the blank page that endpoint health checks render, so
+# none of the converter's own load options get in the way
+HEALTH_CHECK_LOAD_OPTIONS = {
+    "wait_until": "load",
+    "wait_for_selector": None,
+    "wait_for_function": None,
+    "wait_for_fonts": False,
+    "block_resource_types": None,
+    "block_url_patterns": None,
+    "timeout": 10000,
+}
+
+FONTS_READY_SCRIPT = "() => document.fonts.status === 'loaded'"
+
+RESET_PAGE_STORAGE_SCRIPT = """async () => {
+    try {
+        window.localStorage.clear();
+        window.sessionStorage.clear();
+    } catch (e) {}
+    try {
+        const databases = await window.indexedDB.databases();
+        await Promise.all(databases.map(({ name }) => new Promise((resolve) => {
+            // Open connections block the deletion until the page navigates away
+            const request = window.indexedDB.deleteDatabase(name);
+            request.onsuccess = request.onerror = request.onblocked = resolve;
+        })));
+    } catch (e) {}
+    try {
+        const keys = await window.caches.keys();
+        await Promise.all(keys.map((key) => window.caches.delete(key)));
+    } catch (e) {}
+    try {
+        const registrations = await navigator.serviceWorker.getRegistrations();
+        await Promise.all(registrations.map((registration) => registration.unregister()));
+    } catch (e) {}
+}"""
+
+# The document that from_parts puts all of the parts into. Each part gets its
+# own shadow root, so the styles of one part don't leak into the others
+PARTS_DOCUMENT = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+.pyhtmltopdf-part { position: relative; }
+.pyhtmltopdf-part + .pyhtmltopdf-part { break-before: page; }
+.pyhtmltopdf-bookmark {
+    position: absolute;
+    width: 1px;
+    height: 1px;
+    margin: 0;
+    overflow: hidden;
+    clip-path: inset(50%);
+}
+</style>
+</head>
+<body></body>
+</html>"""
+
+APPEND_PART_SCRIPT = """([html, title, bookmark]) => {
+    window.pyhtmltopdfLoading = window.pyhtmltopdfLoading || 0;
+    const part = document.createElement("div");
+    part.className = "pyhtmltopdf-part";
+    const host = document.createElement("div");
+    const root = host.attachShadow({ mode: "open" });
+    root.innerHTML = html;
+    for (const element of root.querySelectorAll("img, link[rel=stylesheet]")) {
+        if (element.tagName === "IMG") {
+            // Lazy images outside the viewport would never load, and the
+            // PDF needs all of them anyway
+            element.loading = "eager";
+            if (element.complete) {
+                continue;
+            }
+        }
+        window.pyhtmltopdfLoading++;
+        const done = () => window.pyhtmltopdfLoading--;
+        element.addEventListener("load", done, { once: true });
+        element.addEventListener("error", done, { once: true });
+    }
+    if (bookmark) {
+        const heading = document.createElement("h1");
+        heading.className = "pyhtmltopdf-bookmark";
+        heading.textContent = title || root.querySelector("title")?.textContent || "";
+        part.appendChild(heading);
+    }
+    part.appendChild(host);
+    document.body.appendChild(part);
+}"""
+
+PARTS_READY_SCRIPT = "() => !window.pyhtmltopdfLoading"
+
+# Measures a document laid out at the printable size of its pages, see
+# preflight. The forced page breaks split the document into sections that are
+# paginated on their own, which gets the page count right as long as nothing
+# taller than a page has to be kept in one piece.
+PREFLIGHT_SCRIPT = """([pageWidth, pageHeight, maxElements]) => {
+    const elements = [];
+    const collect = root => {
+        for (const element of root.querySelectorAll("*")) {
+            elements.push(element);
+            if (element.shadowRoot) {
+                collect(element.shadowRoot);
+            }
+        }
+    };
+    collect(document);
+
+    const describe = element =>
+        element.tagName.toLowerCase() +
+        (element.id ? "#" + element.id : "") +
+        [...element.classList].map(name => "." + name).join("");
+    const outside = rect => rect.right > pageWidth + 1 || rect.left < -1;
+    const forced = ["page", "always", "left", "right", "recto", "verso"];
+    const unsplittable = ["img", "svg", "canvas", "video", "iframe", "object", "embed"];
+
+    const breaks = [0];
+    const overflowing = [];
+    const warnings = [];
+    for (const element of elements) {
+        const rect = element.getBoundingClientRect();
+        const style = getComputedStyle(element);
+        if (forced.includes(style.breakBefore)) {
+            breaks.push(rect.top + window.scrollY);
+        }
+        if (forced.includes(style.breakAfter)) {
+            breaks.push(rect.bottom + window.scrollY);
+        }
+        if (
+            unsplittable.includes(element.tagName.toLowerCase()) &&
+            rect.height > pageHeight + 1
+        ) {
+            warnings.push(describe(element) + " is taller than a page and gets cut off");
+        }
+
+        // Only the outermost element that sticks out is reported, not all of
+        // the children that stick out along with it
+        const parent = element.parentElement || element.getRootNode().host;
+        if (!parent || rect.width === 0 || !outside(rect)) {
+            continue;
+        }
+        if (!outside(parent.getBoundingClientRect()) &&
+            getComputedStyle(parent).overflowX === "visible") {
+            overflowing.push({
+                element: describe(element),
+                width: Math.round(rect.width),
+                overflow: Math.round(Math.max(rect.right - pageWidth, -rect.left)),
+            });
+        }
+    }
+
+    const height = Math.max(
+        document.documentElement.scrollHeight,
+        document.body ? document.body.scrollHeight : 0,
+    );
+    breaks.push(height);
+    breaks.sort((a, b) => a - b);
+    let pageCount = 0;
+    for (let i = 1; i < breaks.length; i++) {
+        const section = Math.min(breaks[i], height) - breaks[i - 1];
+        if (section > 0.5) {
+            pageCount += Math.ceil((section - 0.5) / pageHeight);
+        }
+    }
+
+    if (document.fonts.status !== "loaded") {
+        warnings.push("Web fonts are still loading");
+    }
+    return {
+        pageCount: Math.max(pageCount, 1),
+        overflowing: overflowing.slice(0, maxElements),
+        warnings: warnings,
+    };
+}"""
+
+# How many overflowing elements a preflight report lists at most
+MAX_PREFLIGHT_ELEMENTS = 50
+
+# Where from_string serves its assets from when there is no base_url. The
+# .invalid top level domain never resolves, so nothing leaks to the network
+VIRTUAL_BASE_URL = "https://pyhtmltopdf.invalid/"
+
+PDF_ARGUMENTS = ("output_path", "header_html", "footer_html", "render_options")
+
+JOB_METHODS = {
+    "file_path": "from_file",
+    "url": "from_url",
+    "string": "from_string",
+    "template": "from_template",
+    "parts": "from_parts",
+}
+
+# Called with the data of each job rendered from a template, see from_template
+DEFAULT_RENDER_FUNCTION = "data => window.render(data)"
+
+
+def _split_job(job):
+    sources = [key for key in JOB_METHODS if key in job]
+    if len(sources) != 1:
+        raise ValueError(
+            "A job needs exactly one of the keys " + ", ".join(JOB_METHODS)
+        )
+    kwargs = dict(job)
+    source = kwargs.pop(sources[0])
+    return JOB_METHODS[sources[0]], source, kwargs
+
+
+def _url_matches(url, patterns):
+    # Globs are matched against the URL without its query string, compiled
+    # regular expressions are searched for in the whole URL
+    path = urllib.parse.urldefrag(url)[0].split("?", 1)[0]
+    for pattern in patterns:
+        if isinstance(pattern, re.Pattern):
+            if pattern.search(url):
+                return True
+        elif fnmatch.fnmatchcase(path, pattern):
+            return True
+    return False
+
+
+def _remaining_timeout(deadline):
+    if deadline is None:
+        return None
+    # A timeout of 0 would mean no timeout at all to playwright
+    return max((deadline - time.monotonic()) * 1000, 1)
+
+
+def _is_main_document(request):
+    return request.is_navigation_request() and request.frame.parent_frame is None
+
+
+def _document_url(base_url):
+    parts = urllib.parse.urlsplit(base_url)
+    if parts.scheme not in ("http", "https"):
+        raise ValueError(
+            "base_url has to be an http:// or https:// URL, or a file:// URL "
+            "without assets"
+        )
+    return urllib.parse.urlunsplit(
+        (parts.scheme, parts.netloc.lower(), parts.path or "/", parts.query, "")
+    )
+
+
+def _directory_url(base_url):
+    # The directory a file:// base_url points into, or base_url itself if it
+    # already is one
+    parts = urllib.parse.urlsplit(base_url)
+    path = parts.path or "/"
+    return urllib.parse.urlunsplit(
+        ("file", parts.netloc, path[: path.rindex("/") + 1], "", "")
+    )
+
+
+def _asset_path(url, prefix):
+    # The path of url below prefix, or None for URLs outside of it
+    url = urllib.parse.urlsplit(url)._replace(query="", fragment="").geturl()
+    if not url.startswith(prefix):
+        return None
+    return urllib.parse.unquote(url[len(prefix) :])
+
+
+def _asset_content_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _split_endpoint(endpoint):
+    kinds = [kind for kind in ENDPOINT_KINDS if kind in endpoint]
+    if len(kinds) != 1:
+        raise ValueError(f"Endpoints need exactly one of {', '.join(ENDPOINT_KINDS)}")
+    kind = kinds[0]
+    options = {key: value for key, value in endpoint.items() if key != kind}
+    return kind, endpoint[kind], options
+
+
+async def _iterate_jobs(jobs):
+    if hasattr(jobs, "__aiter__"):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
+
+
+async def _next_job(jobs):
+    try:
+        return True, await jobs.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+class RenderResult:
+    def __init__(self, index, job, pdf=None, error=None):
+        self.index = index
+        self.job = job
+        self.pdf = pdf
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else repr(self.error)
+        return f"<RenderResult index={self.index} {status}>"
+
+
+def _pdf_options(header_html, footer_html, render_options):
+    return {
+        "display_header_footer": header_html != "" or footer_html != "",
+        "header_template": header_html,
+        "footer_template": footer_html,
+        "format": "A4",
+    } | render_options
+
+
+def _file_identity(file_path):
+    with open(file_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return f"file:{file_path}:{os.stat(file_path).st_mtime_ns}:{digest}"
+
+
+def _string_identity(string, base_url):
+    digest = hashlib.sha256(string.encode()).hexdigest()
+    return f"string:{base_url}:{digest}"
+
+
+def _iterate_parts(parts):
+    for part in parts:
+        if isinstance(part, str):
+            yield part, None
+        elif "string" in part:
+            yield part["string"], part.get("title")
+        else:
+            with open(part["file_path"], encoding="utf-8") as f:
+                yield f.read(), part.get("title")
+
+
+def _chunk_job(job, index, chunk_pages):
+    method, source, kwargs = _split_job(job)
+    render_options = kwargs.get("render_options", {})
+    if "page_ranges" in render_options or kwargs.get("output_stream") is not None:
+        raise ValueError(
+            "Chunked rendering supports neither page_ranges nor output_stream"
+        )
+    first_page = index * chunk_pages + 1
+    chunk = dict(job)
+    chunk["render_options"] = render_options | {
+        "page_ranges": f"{first_page}-{first_page + chunk_pages - 1}"
+    }
+    chunk.pop("output_path", None)
+    chunk.pop("return_bytes", None)
+    return chunk
+
+
+class _Chunks:
+    # Keeps track of the chunks of a chunked render. Chunks are handed out in
+    # order until one turns out to be the last, the ones that are still
+    # running by then are wasted.
+    def __init__(self, job, chunk_pages):
+        if chunk_pages < 1:
+            raise ValueError("chunk_pages must be at least 1")
+        _chunk_job(job, 0, chunk_pages)
+        self._job = job
+        self._chunk_pages = chunk_pages
+        self._pdfs = {}
+        self._last = None
+        self._next = 0
+
+    def next_job(self):
+        if self._last is not None and self._next > self._last:
+            return None, None
+        index = self._next
+        self._next += 1
+        return index, _chunk_job(self._job, index, self._chunk_pages)
+
+    def _set_last(self, index):
+        if self._last is None or index < self._last:
+            self._last = index
+
+    def done(self, index, pdf):
+        self._pdfs[index] = pdf
+        if _pdf_page_count(pdf) < self._chunk_pages:
+            self._set_last(index)
+
+    def failed(self, index, exc):
+        # Chromium refuses to print page ranges starting after the last page,
+        # which happens when the page count is a multiple of chunk_pages
+        if index == 0 or "exceeds page count" not in str(exc):
+            raise exc
+        self._set_last(index - 1)
+
+    def merge(self):
+        return _merge_pdfs(
+            [self._pdfs[index] for index in range(self._last + 1)],
+            self._job.get("output_path"),
+        )
+
+
+def _import_pypdf():
+    try:
+        import pypdf
+    except ImportError as exc:
+        raise RuntimeError(
+            "Stitching and optimizing PDFs requires pypdf, "
+            'install it with pip install "pyhtmltopdf[pdf]"'
+        ) from exc
+    return pypdf
+
+
+# What optimize_options turns on when it's not empty, see _optimize_pdf
+DEFAULT_OPTIMIZE_OPTIONS = {
+    "deduplicate": True,
+    "compress": True,
+    "max_image_dpi": None,
+    "image_quality": 85,
+}
+
+# Only opaque images are downsampled, since replacing an image drops its
+# soft mask
+DOWNSAMPLED_IMAGE_MODES = ("RGB", "L", "CMYK")
+
+
+def _downsample_images(writer, max_dpi, quality):
+    try:
+        import PIL
+    except ImportError as exc:
+        raise RuntimeError(
+            "Downsampling images requires Pillow, "
+            'install it with pip install "pyhtmltopdf[pdf]"'
+        ) from exc
+
+    for page in writer.pages:
+        # No image is displayed larger than its page, so this is the lowest
+        # resolution it can have
+        max_width = float(page.mediabox.width) / 72 * max_dpi
+        max_height = float(page.mediabox.height) / 72 * max_dpi
+        for image in page.images:
+            pixels = image.image
+            if (
+                image.indirect_reference is None
+                or pixels.mode not in DOWNSAMPLED_IMAGE_MODES
+                or (pixels.width <= max_width and pixels.height <= max_height)
+            ):
+                continue
+            scale = min(max_width / pixels.width, max_height / pixels.height)
+            size = (
+                max(1, round(pixels.width * scale)),
+                max(1, round(pixels.height * scale)),
+            )
+            image.replace(pixels.resize(size), quality=quality)
+
+
+def _optimize_pdf(pdf, optimize_options):
+    options = DEFAULT_OPTIMIZE_OPTIONS | optimize_options
+    writer = _import_pypdf().PdfWriter(clone_from=io.BytesIO(pdf))
+    if options["max_image_dpi"]:
+        _downsample_images(writer, options["max_image_dpi"], options["image_quality"])
+    if options["compress"]:
+        for page in writer.pages:
+            page.compress_content_streams(level=9)
+    if options["deduplicate"]:
+        # Chromium embeds things like font subsets and images once per page
+        writer.compress_identical_objects()
+    output = io.BytesIO()
+    writer.write(output)
+    optimized = output.getvalue()
+    return optimized if len(optimized) < len(pdf) else pdf
+
+
+def _pdf_page_count(pdf):
+    return len(_import_pypdf().PdfReader(io.BytesIO(pdf)).pages)
+
+
+def _merge_pdfs(pdfs, output_path=None):
+    writer = _import_pypdf().PdfWriter()
+    for pdf in pdfs:
+        writer.append(io.BytesIO(pdf))
+    output = io.BytesIO()
+    writer.write(output)
+    pdf = output.getvalue()
+    if output_path:
+        with open(output_path, "wb") as f:
+            f.write(pdf)
+    return pdf
+
+
+def _template_identity(template, data):
+    string, base_url, render_function = template
+    digest = hashlib.sha256(
+        json.dumps([string, render_function, data], sort_keys=True).encode()
+    ).hexdigest()
+    return f"template:{base_url}:{digest}"
+
+
+def _cache_key(identity, header_html, footer_html, render_options, load_options):
+    options = _pdf_options(header_html, footer_html, render_options)
+    options.pop("path", None)
+    data = json.dumps([identity, options, load_options], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+# Paper sizes in inches, the same ones page.pdf() accepts as "format"
+PAPER_FORMATS = {
+    "letter": (8.5, 11),
+    "legal": (8.5, 14),
+    "tabloid": (11, 17),
+    "ledger": (17, 11),
+    "a0": (33.1, 46.8),
+    "a1": (23.4, 33.1),
+    "a2": (16.54, 23.4),
+    "a3": (11.7, 16.54),
+    "a4": (8.27, 11.7),
+    "a5": (5.83, 8.27),
+    "a6": (4.13, 5.83),
+}
+
+PIXELS_PER_UNIT = {"px": 1, "in": 96, "cm": 37.8, "mm": 3.78}
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Reading the memory usage of the browser processes means walking /proc, so
+# it is only done every couple of seconds
+MEMORY_CHECK_INTERVAL = 10
+
+
+def _to_inches(value):
+    if isinstance(value, (int, float)):
+        return value / 96
+    unit = value[-2:].lower()
+    if unit in PIXELS_PER_UNIT:
+        return float(value[:-2]) * PIXELS_PER_UNIT[unit] / 96
+    return float(value) / 96
+
+
+def _print_to_pdf_params(pdf_options):
+    # Translates page.pdf() options into the CDP Page.printToPDF parameters
+    # the same way playwright does, so streamed PDFs look identical
+    width, height = 8.5, 11
+    # Like in playwright, width and height only count without a format
+    if pdf_options.get("format"):
+        if pdf_options["format"].lower() not in PAPER_FORMATS:
+            raise ValueError(
+                f"Unknown format {pdf_options['format']!r} in render_options"
+            )
+        width, height = PAPER_FORMATS[pdf_options["format"].lower()]
+    else:
+        if pdf_options.get("width"):
+            width = _to_inches(pdf_options["width"])
+        if pdf_options.get("height"):
+            height = _to_inches(pdf_options["height"])
+
+    margin = pdf_options.get("margin") or {}
+    params = {
+        "paperWidth": width,
+        "paperHeight": height,
+        "marginTop": _to_inches(margin.get("top") or 0),
+        "marginBottom": _to_inches(margin.get("bottom") or 0),
+        "marginLeft": _to_inches(margin.get("left") or 0),
+        "marginRight": _to_inches(margin.get("right") or 0),
+        "transferMode": "ReturnAsStream",
+    }
+    for option, param in (
+        ("scale", "scale"),
+        ("display_header_footer", "displayHeaderFooter"),
+        ("header_template", "headerTemplate"),
+        ("footer_template", "footerTemplate"),
+        ("print_background", "printBackground"),
+        ("landscape", "landscape"),
+        ("page_ranges", "pageRanges"),
+        ("prefer_css_page_size", "preferCSSPageSize"),
+        ("outline", "generateDocumentOutline"),
+        ("tagged", "generateTaggedPDF"),
+    ):
+        if pdf_options.get(option) is not None:
+            params[param] = pdf_options[option]
+    return params
+
+
+def _printable_area(pdf_options):
+    # The size in CSS pixels that the content of every page is laid out at
+    params = _print_to_pdf_params(pdf_options)
+    width, height = params["paperWidth"], params["paperHeight"]
+    if params.get("landscape"):
+        width, height = height, width
+    scale = params.get("scale") or 1
+    width -= params["marginLeft"] + params["marginRight"]
+    height -= params["marginTop"] + params["marginBottom"]
+    return max(1, round(width * 96 / scale)), max(1, round(height * 96 / scale))
+
+
+def _collect_warnings(page):
+    # Gathers what goes wrong while a page loads for its preflight report
+    warnings = []
+
+    def on_console(message):
+        if message.type in ("error", "warning"):
+            warnings.append(f"Console {message.type}: {message.text}")
+
+    def on_request_failed(request):
+        # Blocked resources were left out on purpose
+        if request.failure != "net::ERR_BLOCKED_BY_CLIENT":
+            warnings.append(f"Failed to load {request.url}: {request.failure}")
+
+    def on_response(response):
+        if response.status >= 400:
+            warnings.append(f"Got status {response.status} for {response.url}")
+
+    listeners = {
+        "console": on_console,
+        "requestfailed": on_request_failed,
+        "response": on_response,
+    }
+    for event, listener in listeners.items():
+        page.on(event, listener)
+
+    def stop():
+        for event, listener in listeners.items():
+            page.remove_listener(event, listener)
+
+    return warnings, stop
+
+
+def _collect_dependencies(page, dependencies):
+    # Notes down the local files a page loads, see the dependencies argument
+    def on_request(request):
+        if request.url.startswith("file://"):
+            url_path = urllib.parse.urlparse(request.url).path
+            dependencies.add(urllib.request.url2pathname(url_path))
+
+    page.on("request", on_request)
+    return functools.partial(page.remove_listener, "request", on_request)
+
+
+def _browser_memory_usage(marker=None):
+    # Sums up the resident memory of all processes below this one, which are
+    # the playwright drivers and the browsers they launched. With a marker,
+    # only the browser that has it on its command line and the processes it
+    # started are counted. Only works on Linux.
+    try:
+        pids = [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+    except FileNotFoundError:
+        return None
+
+    children = collections.defaultdict(list)
+    parents = {}
+    memory = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[pid] = int(fields[1])
+        children[parents[pid]].append(pid)
+        memory[pid] = int(fields[21]) * page_size
+
+    if marker is None:
+        descendants = list(children[os.getpid()])
+    else:
+        # Processes the browser started may have been handed the marker too
+        marked = set(_marked_processes(memory, marker.encode()))
+        descendants = [pid for pid in marked if parents[pid] not in marked]
+    total = 0
+    while descendants:
+        pid = descendants.pop()
+        total += memory[pid]
+        descendants.extend(children[pid])
+    return total
+
+
+def _marked_processes(pids, marker):
+    marked = []
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                arguments = f.read().split(b"\0")
+        except OSError:
+            continue
+        if marker in arguments:
+            marked.append(pid)
+    return marked
+
+
+def _decode_chunk(chunk):
+    if chunk.get("base64Encoded"):
+        return base64.b64decode(chunk["data"])
+    return chunk["data"].encode()
+
+
+@contextlib.contextmanager
+def _open_output(output_path):
+    # The PDF goes into a temporary file next to output_path first, which
+    # only replaces output_path once all of it is there
+    if not output_path:
+        yield None
+        return
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "xb") as f:
+            yield f
+        os.replace(temp_path, output_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def _write_chunk(sink, data):
+    if hasattr(sink, "write"):
+        sink.write(data)
+    else:
+        sink.sendall(data)
+
+
+async def _awrite_chunk(sink, data):
+    if not hasattr(sink, "write"):
+        sink.sendall(data)
+        return
+    result = sink.write(data)
+    if inspect.isawaitable(result):
+        await result
+    if hasattr(sink, "drain"):
+        await sink.drain()
+
+
+# The events passed to the hooks of the converters. The ones in STAGE_EVENTS
+# come with the time the stage took in seconds, the ones in SIZE_EVENTS with
+# a number of bytes, and all others with a count of 1.
+STAGE_EVENTS = (
+    "launch", "new_page", "goto", "wait", "preflight", "pdf", "optimize", "close",
+    "render",
+)  # fmt: skip
+SIZE_EVENTS = ("pdf_size", "optimize_savings")
+COUNTER_EVENTS = ("page_reused", "cache_hit", "crash_retry", "error")
+
+DEFAULT_TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)  # fmt: skip
+DEFAULT_SIZE_BUCKETS = tuple(1024 * 4**exponent for exponent in range(10))
+
+
+NO_TIMING = contextlib.nullcontext()
+
+
+class _StageTimer:
+    def __init__(self, hooks, event, error_event=None):
+        self._hooks = hooks
+        self._event = event
+        self._error_event = error_event
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, *args):
+        duration = time.perf_counter() - self._start
+        for hook in self._hooks:
+            hook(self._event, duration)
+            if exc_type is not None and self._error_event is not None:
+                hook(self._error_event, 1)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The extra slot counts the values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        # Cumulative like prometheus buckets, the last one is +Inf
+        return {
+            "buckets": list(
+                zip(self.buckets + (float("inf"),), itertools.accumulate(self.counts))
+            ),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+def _prometheus_histogram(name, labels, histogram):
+    lines = []
+    for bound, count in histogram["buckets"]:
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+        lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+    labels = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{labels} {histogram['sum']}")
+    lines.append(f"{name}_count{labels} {histogram['count']}")
+    return lines
+
+
+class RenderMetrics:
+    def __init__(
+        self, time_buckets=DEFAULT_TIME_BUCKETS, size_buckets=DEFAULT_SIZE_BUCKETS
+    ):
+        self._time_buckets = tuple(time_buckets)
+        self._size_buckets = tuple(size_buckets)
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._histograms = {}
+
+    def __getstate__(self):
+        return (self._time_buckets, self._size_buckets)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __call__(self, event, value):
+        with self._lock:
+            self._counters[event] += 1
+            if event in COUNTER_EVENTS:
+                return
+            histogram = self._histograms.get(event)
+            if histogram is None:
+                buckets = (
+                    self._size_buckets if event in SIZE_EVENTS else self._time_buckets
+                )
+                histogram = self._histograms[event] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def histograms(self):
+        with self._lock:
+            return {
+                event: histogram.snapshot()
+                for event, histogram in self._histograms.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def prometheus(self, prefix="pyhtmltopdf"):
+        # The metrics in the prometheus text exposition format
+        lines = [f"# TYPE {prefix}_events_total counter"]
+        for event, count in sorted(self.counters().items()):
+            lines.append(f'{prefix}_events_total{{event="{event}"}} {count}')
+        histograms = self.histograms()
+        lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+        for event in STAGE_EVENTS:
+            if event in histograms:
+                lines += _prometheus_histogram(
+                    f"{prefix}_stage_seconds", f'stage="{event}"', histograms[event]
+                )
+        for event in SIZE_EVENTS:
+            if event in histograms:
+                lines.append(f"# TYPE {prefix}_{event}_bytes histogram")
+                lines += _prometheus_histogram(
+                    f"{prefix}_{event}_bytes", "", histograms[event]
+                )
+        return "\n".join(lines) + "\n"
+
+
+class RenderCache:
+    def __init__(
+        self,
+        max_memory_size=64 * 1024 * 1024,
+        directory=None,
+        max_disk_size=1024 * 1024 * 1024,
+    ):
+        self._max_memory_size = max_memory_size
+        self._directory = directory
+        self._max_disk_size = max_disk_size
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        self._disk = collections.OrderedDict()
+        self._disk_size = 0
+        self._stats = dict.fromkeys(
+            (
+                "memory_hits",
+                "disk_hits",
+                "misses",
+                "memory_evictions",
+                "disk_evictions",
+            ),
+            0,
+        )
+        if directory is not None:
+            self._scan_directory()
+
+    def __getstate__(self):
+        # Every process gets its own memory tier, the disk tier is shared
+        return (self._max_memory_size, self._directory, self._max_disk_size)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def _scan_directory(self):
+        os.makedirs(self._directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _disk_path(self, key):
+        return os.path.join(self._directory, key + ".pdf")
+
+    def _remember(self, key, pdf):
+        if len(pdf) > self._max_memory_size:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = pdf
+        self._memory_size += len(pdf)
+        while self._memory_size > self._max_memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                pdf = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory
+            self._disk_size -= self._disk.pop(key)
+            return None
+        self._disk.move_to_end(key)
+        return pdf
+
+    def _write_disk(self, key, pdf):
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf)
+        os.replace(temp_path, self._disk_path(key))
+
+        self._disk_size += len(pdf) - self._disk.pop(key, 0)
+        self._disk[key] = len(pdf)
+        while self._disk_size > self._max_disk_size and len(self._disk) > 1:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.remove(self._disk_path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            pdf = self._memory.get(key)
+            if pdf is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return pdf
+
+            if key in self._disk:
+                pdf = self._read_disk(key)
+                if pdf is not None:
+                    self._remember(key, pdf)
+                    self._stats["disk_hits"] += 1
+                    return pdf
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, pdf):
+        with self._lock:
+            self._remember(key, pdf)
+            if self._directory is not None:
+                self._write_disk(key, pdf)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for key in self._disk:
+                try:
+                    os.remove(self._disk_path(key))
+                except FileNotFoundError:
+                    pass
+            self._disk.clear()
+            self._disk_size = 0
+
+    def stats(self):
+        with self._lock:
+            return self._stats | {
+                "memory_size": self._memory_size,
+                "memory_entries": len(self._memory),
+                "disk_size": self._disk_size,
+                "disk_entries": len(self._disk),
+            }
+
+
+DEFAULT_RESOURCE_PATTERNS = (
+    "*.css",
+    "*.js",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.svg",
+    "*.webp",
+)
+
+# Bodies handed out by route.fetch() are already decoded, these headers would
+# make chromium try to decode them a second time
+STRIPPED_RESOURCE_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def _resource_headers(headers):
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() not in STRIPPED_RESOURCE_HEADERS
+    }
+
+
+class ResourceCache:
+    def __init__(
+        self, max_size=256 * 1024 * 1024, url_patterns=DEFAULT_RESOURCE_PATTERNS
+    ):
+        self._max_size = max_size
+        self._url_patterns = url_patterns
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._stats = dict.fromkeys(("hits", "misses", "evictions"), 0)
+
+    def __getstate__(self):
+        with self._lock:
+            return (self._max_size, self._url_patterns, list(self._entries.items()))
+
+    def __setstate__(self, state):
+        max_size, url_patterns, entries = state
+        self.__init__(max_size, url_patterns)
+        for url, (status, headers, body) in entries:
+            self.put(url, status, headers, body)
+
+    def matches(self, url):
+        return _url_matches(url, self._url_patterns)
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(url)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, url, status, headers, body):
+        headers = _resource_headers(headers)
+        with self._lock:
+            if len(body) > self._max_size:
+                return
+            if url in self._entries:
+                self._size -= len(self._entries.pop(url)[2])
+            self._entries[url] = (status, headers, body)
+            self._size += len(body)
+            while self._size > self._max_size:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._stats["evictions"] += 1
+
+    def preload(self, url, file_path=None, body=None, content_type=None):
+        if body is None:
+            with open(file_path, "rb") as f:
+                body = f.read()
+        if content_type is None:
+            content_type = (
+                mimetypes.guess_type(file_path or url)[0] or "application/octet-stream"
+            )
+        self.put(url, 200, {"content-type": content_type}, body)
+
+    def preload_directory(self, directory, base_url):
+        # Serves every file below directory as if it was hosted at base_url
+        for root, _, files in os.walk(directory):
+            for name in files:
+                file_path = os.path.join(root, name)
+                relative_path = os.path.relpath(file_path, directory)
+                url = urllib.parse.urljoin(
+                    base_url, urllib.parse.quote(relative_path.replace(os.sep, "/"))
+                )
+                self.preload(url, file_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return self._stats | {"size": self._size, "entries": len(self._entries)}
+
+
+def _job_digest(job):
+    job = {key: value for key, value in job.items() if key != "dependencies"}
+    data = json.dumps(job, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# Stands in for the modification time of files that changed while the output
+# was rendered, so the output is always rendered again
+CHANGED_WHILE_RENDERING = -1
+
+
+class RenderManifest:
+    # Remembers which local files every output was rendered from, so only the
+    # outputs whose files changed since have to be rendered again
+    def __init__(self, path=None):
+        self._path = path
+        self._outputs = {}
+        self._mtimes = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._outputs = json.load(f)
+
+    def _mtime(self, path):
+        # Every file is only looked at once between rescans, no matter how
+        # many outputs depend on it
+        if path not in self._mtimes:
+            self._mtimes[path] = _mtime(path)
+        return self._mtimes[path]
+
+    def rescan(self):
+        self._mtimes.clear()
+
+    def stale(self, job, retry_failed=True):
+        entry = self._outputs.get(job["output_path"])
+        if entry is None or entry["job"] != _job_digest(job):
+            return True
+        if entry["failed"]:
+            if retry_failed:
+                return True
+        elif _mtime(job["output_path"]) is None:
+            return True
+        return any(
+            self._mtime(path) != mtime for path, mtime in entry["dependencies"].items()
+        )
+
+    def record(self, job, dependencies, since=None, failed=False):
+        recorded = {}
+        for path in sorted(dependencies):
+            mtime = _mtime(path)
+            if since is not None and mtime is not None and mtime >= since:
+                mtime = CHANGED_WHILE_RENDERING
+            recorded[path] = mtime
+        self._outputs[job["output_path"]] = {
+            "job": _job_digest(job),
+            "dependencies": recorded,
+            "failed": failed,
+        }
+
+    def forget(self, output_path):
+        self._outputs.pop(output_path, None)
+
+    def dependents(self, path):
+        return sorted(
+            output_path
+            for output_path, entry in self._outputs.items()
+            if path in entry["dependencies"]
+        )
+
+    def save(self):
+        if self._path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._outputs, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self._path)
+
+
 class AHTMLToPDFConverter:
-    def __init__(self, launch_options={}):
+    def __init__(
+        self,
+        launch_options={},
+        page_pool_size=0,
+        cache=None,
+        resource_cache=None,
+        load_options={},
+        recycle_options={},
+        hooks=[],
+        context_options={},
+        max_contexts=16,
+        endpoint=None,
+        optimize_options={},
+        max_template_pages=16,
+    ):
+        self._launch_options = launch_options
+        self._optimize_options = optimize_options
+        # Where the browser comes from, launched locally by default
+        self._endpoint = endpoint or {"launch": launch_options}
+        _split_endpoint(self._endpoint)
+        self._load_options = load_options
+        self._recycle_options = recycle_options
+        self._hooks = tuple(hooks)
+        self._page_pool_size = page_pool_size
+        self._cache = cache
+        self._resource_cache = resource_cache
+        self._browser = None
+        self._playwright = None
+        self._idle_pages = []
+        self._crashed_pages = set()
+        # Warm pages with a template loaded by template, least recently used
+        # first, see from_template
+        self._max_template_pages = max_template_pages
+        self._template_pages = collections.OrderedDict()
+        self._page_templates = {}
+        self._template_page_evictions = 0
+        self._page_pool_hits = 0
+        self._page_pool_misses = 0
+        self._page_pool_replaced = 0
+        self._browser_launched = 0
+        self._browser_renders = 0
+        self._next_memory_check = 0
+        self._browser_marker = None
+        self._browser_launches = 0
+        self._browser_recycles = 0
+        self._crash_retries = 0
+        # Browser contexts by key, least recently used first, see
+        # set_context_options
+        self._context_options = dict(context_options)
+        self._max_contexts = max_contexts
+        self._contexts = collections.OrderedDict()
+        self._context_pages = {}
+        self._context_jobs = collections.Counter()
+        self._retired_contexts = set()
+        self._context_hits = 0
+        self._context_misses = 0
+        self._context_evictions = 0
+        self._browser_lock = None
+        self._browser_jobs = collections.Counter()
+        self._retired_browsers = set()
+        self._context_lock = None
+
+    async def init(self):
+        self._playwright = await async_playwright().start()
+        self._browser_lock = asyncio.Lock()
+        self._context_lock = asyncio.Lock()
+
+        try:
+            self._browser = await self._launch_browser()
+        except PlaywrightError as exc:
+            await self._playwright.stop()
+            raise RuntimeError(
+                "An exception occurred while trying to launch browser"
+            ) from exc
+
+    async def finish(self):
+        self._forget_idle_pages()
+        self._forget_contexts()
+        self._crashed_pages.clear()
+        for browser in self._retired_browsers:
+            await self._close_browser(browser)
+        self._retired_browsers.clear()
+        await self._browser.close()
+        await self._playwright.stop()
+
+    async def __aenter__(self):
+        await self.init()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.finish()
+
+    async def _pdf_from_page(
+        self,
+        page,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        output_stream=None,
+        return_bytes=True,
+        optimize_options={},
+    ):
+        render_options = _pdf_options(header_html, footer_html, render_options)
+        if optimize_options:
+            return await self._optimized_pdf_from_page(
+                page,
+                output_path,
+                render_options,
+                output_stream,
+                return_bytes,
+                optimize_options,
+            )
+        if output_stream is None and (return_bytes or not output_path):
+            if output_path:
+                render_options["path"] = output_path
+            pdf = await page.pdf(**render_options)
+            if self._hooks:
+                self._emit("pdf_size", len(pdf))
+            return pdf
+
+        # Have chromium hand out the PDF in chunks and pass each one on right
+        # away, instead of holding the whole document in memory
+        params = _print_to_pdf_params(render_options)
+        with _open_output(output_path) as output_file:
+            sinks = [sink for sink in (output_file, output_stream) if sink is not None]
+            size = 0
+            session = await page.context.new_cdp_session(page)
+            try:
+                result = await session.send("Page.printToPDF", params)
+                while True:
+                    chunk = await session.send(
+                        "IO.read",
+                        {"handle": result["stream"], "size": STREAM_CHUNK_SIZE},
+                    )
+                    data = _decode_chunk(chunk)
+                    size += len(data)
+                    for sink in sinks:
+                        await _awrite_chunk(sink, data)
+                    if chunk["eof"]:
+                        break
+                await session.send("IO.close", {"handle": result["stream"]})
+            finally:
+                await session.detach()
+        if self._hooks:
+            self._emit("pdf_size", size)
+        return None
+
+    async def _optimized_pdf_from_page(
+        self,
+        page,
+        output_path,
+        render_options,
+        output_stream,
+        return_bytes,
+        optimize_options,
+    ):
+        # Optimizing needs the whole PDF, so it's only streamed out afterwards.
+        # Only the optimized PDF may end up in a file, never the original one.
+        render_options.pop("path", None)
+        pdf = await page.pdf(**render_options)
+        with self._timed("optimize"):
+            optimized = await asyncio.get_running_loop().run_in_executor(
+                None, _optimize_pdf, pdf, optimize_options
+            )
+        if self._hooks:
+            self._emit("pdf_size", len(optimized))
+            self._emit("optimize_savings", len(pdf) - len(optimized))
+        with _open_output(output_path) as output_file:
+            for sink in (output_file, output_stream):
+                if sink is not None:
+                    await _awrite_chunk(sink, optimized)
+        if output_stream is None and (return_bytes or not output_path):
+            return optimized
+        return None
+
+    def _timed(self, event, error_event=None):
+        if not self._hooks:
+            return NO_TIMING
+        return _StageTimer(self._hooks, event, error_event)
+
+    def _emit(self, event, value=1):
+        for hook in self._hooks:
+            hook(event, value)
+
+    async def _launch_browser(self):
+        kind, target, options = _split_endpoint(self._endpoint)
+        with self._timed("launch"):
+            if kind == "launch":
+                # Chromium ignores the unknown switch, it only tells this
+                # browser's processes apart from all others
+                self._browser_marker = f"--pyhtmltopdf-browser={uuid.uuid4().hex}"
+                options = DEFAULT_LAUNCH_OPTIONS | target
+                options["args"] = [*(options.get("args") or ()), self._browser_marker]
+                browser = await self._playwright.chromium.launch(**options)
+            else:
+                browser = await getattr(self._playwright.chromium, kind)(
+                    target, **options
+                )
+        self._browser_launched = time.monotonic()
+        self._next_memory_check = self._browser_launched + MEMORY_CHECK_INTERVAL
+        self._browser_renders = 0
+        self._browser_launches += 1
+        return browser
+
+    async def _close_browser(self, browser):
+        try:
+            await browser.close()
+        except PlaywrightError:
+            pass
+
+    def _recycle_due(self):
+        max_renders = self._recycle_options.get("max_renders")
+        if max_renders and self._browser_renders >= max_renders:
+            return True
+        max_age = self._recycle_options.get("max_age")
+        if max_age and time.monotonic() - self._browser_launched >= max_age:
+            return True
+        # Only a local browser's memory usage can be measured
+        max_memory = self._recycle_options.get("max_memory")
+        if "launch" not in self._endpoint:
+            max_memory = None
+        if max_memory and time.monotonic() >= self._next_memory_check:
+            self._next_memory_check = time.monotonic() + MEMORY_CHECK_INTERVAL
+            memory = _browser_memory_usage(self._browser_marker)
+            if memory is not None and memory > max_memory:
+                return True
+        return False
+
+    async def _ensure_browser(self):
+        async with self._browser_lock:
+            if not self._browser.is_connected() or self._recycle_due():
+                if self._browser.is_connected():
+                    self._browser_recycles += 1
+                old_browser = self._browser
+                self._browser = await self._launch_browser()
+                self._forget_idle_pages()
+                self._forget_contexts()
+                # Jobs still running on the old browser get to finish first
+                if self._browser_jobs[old_browser]:
+                    self._retired_browsers.add(old_browser)
+                else:
+                    await self._close_browser(old_browser)
+            self._browser_renders += 1
+            self._browser_jobs[self._browser] += 1
+            return self._browser
+
+    async def _job_done(self, browser):
+        self._browser_jobs[browser] -= 1
+        if self._browser_jobs[browser]:
+            return
+        del self._browser_jobs[browser]
+        if browser in self._retired_browsers:
+            self._retired_browsers.discard(browser)
+            await self._close_browser(browser)
+
+    def browser_stats(self):
+        return {
+            "launches": self._browser_launches,
+            "recycles": self._browser_recycles,
+            "crash_retries": self._crash_retries,
+            "renders": self._browser_renders,
+            "age": time.monotonic() - self._browser_launched,
+            "connected": self._browser.is_connected(),
+        }
+
+    def context_pool_stats(self):
+        return {
+            "size": len(self._contexts),
+            "max_size": self._max_contexts,
+            "in_use": len(self._context_jobs),
+            "hits": self._context_hits,
+            "misses": self._context_misses,
+            "evictions": self._context_evictions,
+        }
+
+    def set_context_options(self, key, options):
+        # Contexts created with the old options are not used for new jobs
+        self._context_options[key] = options
+        context = self._contexts.pop(key, None)
+        if context is not None:
+            self._retired_contexts.add(context)
+
+    def page_pool_stats(self):
+        return {
+            "size": len(self._idle_pages),
+            "max_size": self._page_pool_size,
+            "hits": self._page_pool_hits,
+            "misses": self._page_pool_misses,
+            "replaced": self._page_pool_replaced,
+            "template_pages": sum(map(len, self._template_pages.values())),
+            "max_template_pages": self._max_template_pages,
+            "template_evictions": self._template_page_evictions,
+        }
+
+    async def _new_page(self, browser, context=None):
+        with self._timed("new_page"):
+            if context is None:
+                page = await browser.new_page()
+            else:
+                page = await context.new_page()
+        page.on("crash", self._crashed_pages.add)
+        # What a context fetches can depend on its credentials, so only pages
+        # without one share cached resources
+        if self._resource_cache is not None and context is None:
+            await page.route(self._resource_cache.matches, self._serve_cached_resource)
+        return page
+
+    async def _serve_cached_resource(self, route):
+        request = route.request
+        if request.method != "GET" or request.is_navigation_request():
+            await route.fallback()
+            return
+
+        entry = self._resource_cache.get(request.url)
+        if entry is None:
+            try:
+                response = await route.fetch()
+                body = await response.body()
+            except PlaywrightError:
+                # Let chromium run into the same error on its own
+                await route.fallback()
+                return
+            entry = (response.status, _resource_headers(response.headers), body)
+            if response.status == 200:
+                self._resource_cache.put(request.url, *entry)
+
+        status, headers, body = entry
+        await route.fulfill(status=status, headers=headers, body=body)
+
+    async def _discard_page(self, page):
+        self._crashed_pages.discard(page)
+        self._page_templates.pop(page, None)
+        try:
+            await page.close()
+        except PlaywrightError:
+            pass
+
+    def _forget_contexts(self):
+        # The contexts die with their browser
+        self._contexts.clear()
+        self._context_pages = {}
+        self._retired_contexts.clear()
+
+    async def _close_context(self, context):
+        for page in self._context_pages.pop(context, []):
+            self._crashed_pages.discard(page)
+            self._page_templates.pop(page, None)
+        try:
+            await context.close()
+        except PlaywrightError:
+            pass
+
+    async def _evict_contexts(self):
+        for context in list(self._retired_contexts):
+            if not self._context_jobs[context]:
+                self._retired_contexts.discard(context)
+                await self._close_context(context)
+        # Contexts that are in use are never evicted, so the pool can be
+        # over its size until their jobs are done
+        for key, context in list(self._contexts.items()):
+            if len(self._contexts) <= self._max_contexts:
+                break
+            if not self._context_jobs[context]:
+                del self._contexts[key]
+                self._context_evictions += 1
+                await self._close_context(context)
+
+    def _forget_idle_pages(self):
+        for pages in self._template_pages.values():
+            for page in pages:
+                self._page_templates.pop(page, None)
+        self._idle_pages = []
+        self._template_pages = collections.OrderedDict()
+
+    async def _acquire_context(self, browser, key):
+        context = self._contexts.get(key)
+        if context is not None and context.browser is browser:
+            self._context_hits += 1
+        else:
+            # A context of a replaced browser died along with it
+            if context is not None:
+                self._context_pages.pop(context, None)
+            self._context_misses += 1
+            context = await browser.new_context(**self._context_options.get(key, {}))
+            self._contexts[key] = context
+            self._context_pages[context] = []
+        self._contexts.move_to_end(key)
+        self._context_jobs[context] += 1
+        await self._evict_contexts()
+        return context
+
+    async def _context_done(self, context):
+        self._context_jobs[context] -= 1
+        if not self._context_jobs[context]:
+            del self._context_jobs[context]
+            await self._evict_contexts()
+
+    async def _acquire_page(self, browser, template=None, context=None):
+        idle_pages = self._idle_pages
+        if context is not None:
+            idle_pages = self._context_pages.get(context, [])
+        elif template is not None:
+            idle_pages = self._template_pages.get(template, [])
+        while idle_pages and browser is self._browser:
+            page = idle_pages.pop()
+            # Templates without warm pages aren't kept around
+            if not idle_pages and idle_pages is self._template_pages.get(template):
+                del self._template_pages[template]
+            if page not in self._crashed_pages and not page.is_closed():
+                self._page_pool_hits += 1
+                if self._hooks:
+                    self._emit("page_reused")
+                return page
+            self._page_pool_replaced += 1
+            await self._discard_page(page)
+
+        if self._page_pool_size or template is not None or context is not None:
+            self._page_pool_misses += 1
+        return await self._new_page(browser, context)
+
+    async def _release_page(self, page, reuse=True):
+        with self._timed("close"):
+            await self._recycle_page(page, reuse)
+
+    async def _recycle_page(self, page, reuse):
+        if self._context_jobs[page.context]:
+            await self._recycle_context_page(page, reuse)
+            return
+        template = self._page_templates.get(page)
+        if template is not None:
+            # Template pages are kept as they are, the next job overwrites
+            # the data anyway
+            if (
+                reuse
+                and len(self._template_pages.get(template, ()))
+                < max(self._page_pool_size, 1)
+                and page not in self._crashed_pages
+                and not page.is_closed()
+                and page.context.browser is self._browser
+            ):
+                self._template_pages.setdefault(template, []).append(page)
+                self._template_pages.move_to_end(template)
+                await self._evict_template_pages()
+                return
+        elif (
+            reuse
+            and len(self._idle_pages) < self._page_pool_size
+            and page not in self._crashed_pages
+            and not page.is_closed()
+            and page.context.browser is self._browser
+        ):
+            # Wipe everything the last job left behind, so the next one starts
+            # with the same state as a freshly opened page
+            try:
+                await page.evaluate(RESET_PAGE_STORAGE_SCRIPT)
+                await page.goto("about:blank")
+                await page.context.clear_cookies()
+            except PlaywrightError:
+                pass
+            else:
+                # Other pages may have been released in the meantime
+                if len(self._idle_pages) < self._page_pool_size:
+                    self._idle_pages.append(page)
+                    return
+        await self._discard_page(page)
+
+    async def _evict_template_pages(self):
+        # The pages of the least recently used templates are closed first
+        while sum(map(len, self._template_pages.values())) > self._max_template_pages:
+            template, pages = next(iter(self._template_pages.items()))
+            page = pages.pop(0)
+            if not pages:
+                del self._template_pages[template]
+            self._template_page_evictions += 1
+            await self._discard_page(page)
+
+    async def _recycle_context_page(self, page, reuse):
+        # Pages only ever go back to the pool of their own context, and keep
+        # its cookies and storage
+        self._page_templates.pop(page, None)
+        idle_pages = self._context_pages.get(page.context)
+        if (
+            reuse
+            and idle_pages is not None
+            and len(idle_pages) < max(self._page_pool_size, 1)
+            and page not in self._crashed_pages
+            and not page.is_closed()
+            and page.context.browser is self._browser
+        ):
+            try:
+                await page.goto("about:blank")
+            except PlaywrightError:
+                pass
+            else:
+                # Other pages may have been released in the meantime, or the
+                # context closed
+                if self._context_pages.get(page.context) is idle_pages and len(
+                    idle_pages
+                ) < max(self._page_pool_size, 1):
+                    idle_pages.append(page)
+                    return
+        await self._discard_page(page)
+
+    async def _load_url(self, page, load_options, deadline, url):
+        await page.goto(
+            url,
+            wait_until=load_options["wait_until"],
+            timeout=_remaining_timeout(deadline),
+        )
+
+    async def _load_string(self, page, load_options, deadline, string, base_url):
+        if base_url is not None and base_url.lower().startswith("file:"):
+            # file:// URLs can't be routed, so the document is written into
+            # the page of its directory instead. That gives it access to local
+            # files and resolves relative links against the directory.
+            await page.goto(
+                _directory_url(base_url),
+                wait_until="domcontentloaded",
+                timeout=_remaining_timeout(deadline),
+            )
+            base_url = None
+        if base_url is None:
+            await page.set_content(
+                string,
+                wait_until=load_options["wait_until"],
+                timeout=_remaining_timeout(deadline),
+            )
+            return
+
+        # Pretend the document lives at base_url, so relative links resolve
+        # against it, but serve it straight from memory
+        document_url = _document_url(base_url)
+
+        def is_document(url):
+            return url == document_url
+
+        async def serve_document(route):
+            if _is_main_document(route.request):
+                await route.fulfill(
+                    body=string, content_type="text/html; charset=utf-8"
+                )
+            else:
+                await route.fallback()
+
+        await page.route(is_document, serve_document)
+        try:
+            await page.goto(
+                document_url,
+                wait_until=load_options["wait_until"],
+                timeout=_remaining_timeout(deadline),
+            )
+        finally:
+            await page.unroute(is_document, serve_document)
+
+    async def _load_string_with_assets(
+        self, page, load_options, deadline, string, base_url, assets, virtual
+    ):
+        document_url = _document_url(base_url)
+        prefix = document_url[: document_url.rindex("/") + 1]
+
+        def is_asset(url):
+            return url.startswith(prefix)
+
+        async def serve_asset(route):
+            path = _asset_path(route.request.url, prefix)
+            if not path or _is_main_document(route.request):
+                await route.fallback()
+                return
+            try:
+                body = assets(path) if callable(assets) else assets.get(path)
+                if inspect.isawaitable(body):
+                    body = await body
+            except Exception:
+                await route.abort()
+                return
+            if body is not None:
+                await route.fulfill(body=body, content_type=_asset_content_type(path))
+            elif virtual:
+                await route.fulfill(status=404)
+            else:
+                await route.fallback()
+
+        # The assets stay routed until the PDF is done, since printing can
+        # still load images for print styles
+        await page.route(is_asset, serve_asset)
+        await self._load_string(page, load_options, deadline, string, base_url)
+        return functools.partial(page.unroute, is_asset, serve_asset)
+
+    async def _load_template(self, page, load_options, deadline, template, data):
+        string, base_url, render_function = template
+        if page not in self._page_templates:
+            await self._load_string(page, load_options, deadline, string, base_url)
+            self._page_templates[page] = template
+        await page.evaluate(render_function, data)
+
+    async def _load_parts(
+        self, page, load_options, deadline, parts, base_url, bookmarks
+    ):
+        await self._load_string(page, load_options, deadline, PARTS_DOCUMENT, base_url)
+        # Only one part at a time is held in memory, the browser keeps the rest
+        for string, title in _iterate_parts(parts):
+            await page.evaluate(APPEND_PART_SCRIPT, [string, title, bookmarks])
+        await page.wait_for_function(
+            PARTS_READY_SCRIPT, timeout=_remaining_timeout(deadline)
+        )
+
+    async def _wait_until_ready(self, page, load_options, deadline):
+        if load_options.get("wait_for_selector"):
+            await page.wait_for_selector(
+                load_options["wait_for_selector"],
+                state="attached",
+                timeout=_remaining_timeout(deadline),
+            )
+        if load_options.get("wait_for_function"):
+            await page.wait_for_function(
+                load_options["wait_for_function"],
+                timeout=_remaining_timeout(deadline),
+            )
+        if load_options.get("wait_for_fonts"):
+            await page.wait_for_function(
+                FONTS_READY_SCRIPT, timeout=_remaining_timeout(deadline)
+            )
+
+    async def _block_resources(self, page, load_options):
+        resource_types = set(load_options.get("block_resource_types") or ())
+        url_patterns = load_options.get("block_url_patterns") or ()
+        if not resource_types and not url_patterns:
+            return None
+
+        async def block(route):
+            request = route.request
+            if not _is_main_document(request) and (
+                request.resource_type in resource_types
+                or _url_matches(request.url, url_patterns)
+            ):
+                await route.abort("blockedbyclient")
+            else:
+                await route.fallback()
+
+        await page.route("**/*", block)
+        return block
+
+    async def _measure_layout(self, page, pdf_options, warnings):
+        width, height = _printable_area(pdf_options)
+        viewport = page.viewport_size
+        await page.emulate_media(media="print")
+        await page.set_viewport_size({"width": width, "height": height})
+        try:
+            layout = await page.evaluate(
+                PREFLIGHT_SCRIPT, [width, height, MAX_PREFLIGHT_ELEMENTS]
+            )
+        finally:
+            # The page goes back to how it was, so it can be printed right away
+            await page.emulate_media(media="null")
+            if viewport is not None:
+                await page.set_viewport_size(viewport)
+        return {
+            "page_count": layout["pageCount"],
+            "page_size": {"width": width, "height": height},
+            "overflowing": layout["overflowing"],
+            "warnings": warnings + layout["warnings"],
+        }
+
+    async def _render_page(
+        self,
+        page,
+        load,
+        load_options,
+        deadline,
+        output_path,
+        header_html,
+        footer_html,
+        render_options,
+        output_stream,
+        return_bytes,
+        optimize_options,
+        preflight=None,
+        dependencies=None,
+    ):
+        if dependencies is not None:
+            stop_recording = _collect_dependencies(page, dependencies)
+        block = await self._block_resources(page, load_options)
+        if preflight is not None:
+            warnings, stop_collecting = _collect_warnings(page)
+        try:
+            with self._timed("goto"):
+                unroute = await load(page, load_options, deadline)
+            with self._timed("wait"):
+                await self._wait_until_ready(page, load_options, deadline)
+        finally:
+            if preflight is not None:
+                stop_collecting()
+
+        if preflight is not None:
+            with self._timed("preflight"):
+                report = await self._measure_layout(
+                    page,
+                    _pdf_options(header_html, footer_html, render_options),
+                    warnings,
+                )
+            changes = preflight(report)
+            if inspect.isawaitable(changes):
+                changes = await changes
+            if changes:
+                render_options = render_options | changes
+
+        pdf = None
+        if preflight is None or changes is not False:
+            with self._timed("pdf"):
+                pdf = await self._pdf_from_page(
+                    page,
+                    output_path,
+                    header_html,
+                    footer_html,
+                    render_options,
+                    output_stream,
+                    return_bytes,
+                    optimize_options,
+                )
+        if block is not None:
+            await page.unroute("**/*", block)
+        if unroute is not None:
+            await unroute()
+        if dependencies is not None:
+            stop_recording()
+        return pdf
+
+    async def _from_page(self, *args, **kwargs):
+        with self._timed("render", "error"):
+            return await self._convert(*args, **kwargs)
+
+    async def _convert(
+        self,
+        load,
+        identity,
+        template,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        output_stream=None,
+        return_bytes=True,
+        load_options={},
+        retry=True,
+        context=None,
+        optimize_options=None,
+        preflight=None,
+        dependencies=None,
+    ):
+        load_options = DEFAULT_LOAD_OPTIONS | self._load_options | load_options
+        if optimize_options is None:
+            optimize_options = self._optimize_options
+        deadline = None
+        if load_options.get("timeout") is not None:
+            deadline = time.monotonic() + load_options["timeout"] / 1000
+        streaming = output_stream is not None or (output_path and not return_bytes)
+
+        # Whatever the preflight decides isn't part of the cache key, and a
+        # cached PDF doesn't tell which files it was rendered from
+        cache_key = None
+        if (
+            self._cache is not None
+            and identity is not None
+            and preflight is None
+            and dependencies is None
+        ):
+            if context is not None:
+                identity = [identity, context]
+            if optimize_options:
+                identity = [identity, optimize_options]
+            cache_key = _cache_key(
+                identity, header_html, footer_html, render_options, load_options
+            )
+            pdf = self._cache.get(cache_key)
+            if pdf is not None:
+                if self._hooks:
+                    self._emit("cache_hit")
+                if output_path:
+                    with open(output_path, "wb") as f:
+                        f.write(pdf)
+                if output_stream is not None:
+                    await _awrite_chunk(output_stream, pdf)
+                return None if streaming else pdf
+
+        # A crashed browser is relaunched and the job is retried on it, unless
+        # some of the PDF was already streamed to the caller
+        retries = self._recycle_options.get("retries", 1)
+        if output_stream is not None or not retry:
+            retries = 0
+        for attempt in itertools.count():
+            browser = await self._ensure_browser()
+            browser_context = None
+            page = None
+            try:
+                if context is not None:
+                    async with self._context_lock:
+                        browser_context = await self._acquire_context(browser, context)
+                page = await self._acquire_page(browser, template, browser_context)
+                pdf = await self._render_page(
+                    page,
+                    load,
+                    load_options,
+                    deadline,
+                    output_path,
+                    header_html,
+                    footer_html,
+                    render_options,
+                    output_stream,
+                    return_bytes,
+                    optimize_options,
+                    preflight,
+                    dependencies,
+                )
+            except BaseException as exc:
+                crashed = not browser.is_connected() or page in self._crashed_pages
+                if page is not None:
+                    await self._release_page(page, reuse=False)
+                if browser_context is not None:
+                    async with self._context_lock:
+                        await self._context_done(browser_context)
+                await self._job_done(browser)
+                if not (
+                    isinstance(exc, PlaywrightError) and crashed and attempt < retries
+                ):
+                    raise
+                self._crash_retries += 1
+                if self._hooks:
+                    self._emit("crash_retry")
+                continue
+            await self._release_page(page)
+            if browser_context is not None:
+                async with self._context_lock:
+                    await self._context_done(browser_context)
+            await self._job_done(browser)
+            break
+
+        if cache_key is not None and pdf is not None:
+            self._cache.put(cache_key, pdf)
+        return pdf
+
+    async def from_file(self, file_path, *args, **kwargs):
+        file_path = realpath(file_path)
+        load = functools.partial(self._load_url, url="file://" + file_path)
+        identity = _file_identity(file_path) if self._cache is not None else None
+        return await self._from_page(load, identity, None, *args, **kwargs)
+
+    async def from_url(self, url, *args, cache_version=None, **kwargs):
+        load = functools.partial(self._load_url, url=url)
+        # Only the caller knows when the content behind a URL changes
+        identity = None if cache_version is None else f"url:{url}:{cache_version}"
+        return await self._from_page(load, identity, None, *args, **kwargs)
+
+    async def from_string(self, string, *args, base_url=None, assets=None, **kwargs):
+        identity = None
+        if assets is not None:
+            # Whatever the assets contain is unknown, so this can't be cached
+            load = functools.partial(
+                self._load_string_with_assets,
+                string=string,
+                base_url=base_url or VIRTUAL_BASE_URL,
+                assets=assets,
+                virtual=base_url is None,
+            )
+        else:
+            load = functools.partial(
+                self._load_string, string=string, base_url=base_url
+            )
+            if self._cache is not None:
+                identity = _string_identity(string, base_url)
+        return await self._from_page(load, identity, None, *args, **kwargs)
+
+    async def from_template(
+        self,
+        template,
+        data,
+        *args,
+        base_url=None,
+        render_function=DEFAULT_RENDER_FUNCTION,
+        **kwargs,
+    ):
+        template = (template, base_url, render_function)
+        load = functools.partial(self._load_template, template=template, data=data)
+        identity = None
+        if self._cache is not None:
+            identity = _template_identity(template, data)
+        return await self._from_page(load, identity, template, *args, **kwargs)
+
+    async def from_parts(
+        self,
+        parts,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        *args,
+        base_url=None,
+        bookmarks=False,
+        **kwargs,
+    ):
+        load = functools.partial(
+            self._load_parts, parts=parts, base_url=base_url, bookmarks=bookmarks
+        )
+        if bookmarks:
+            render_options = {"outline": True, "tagged": True} | render_options
+        # A generator of parts can only be gone through once
+        retry = iter(parts) is not parts
+        return await self._from_page(
+            load,
+            None,
+            None,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            *args,
+            retry=retry,
+            **kwargs,
+        )
+
+    async def preflight(self, job):
+        reports = []
+
+        def measured(report):
+            reports.append(report)
+            return False
+
+        method, source, kwargs = _split_job(job)
+        await getattr(self, method)(source, preflight=measured, **kwargs)
+        return reports[-1]
+
+    async def _render_job(self, index, job):
+        try:
+            method, source, kwargs = _split_job(job)
+            pdf = await getattr(self, method)(source, **kwargs)
+        except Exception as exc:
+            return RenderResult(index, job, error=exc)
+        return RenderResult(index, job, pdf=pdf)
+
+    async def render_chunked(self, job, chunk_pages=50, concurrency=4):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        chunks = _Chunks(job, chunk_pages)
+
+        async def render_chunks():
+            while True:
+                index, chunk = chunks.next_job()
+                if chunk is None:
+                    return
+                method, source, kwargs = _split_job(chunk)
+                try:
+                    pdf = await getattr(self, method)(source, **kwargs)
+                except PlaywrightError as exc:
+                    chunks.failed(index, exc)
+                else:
+                    chunks.done(index, pdf)
+
+        tasks = [asyncio.ensure_future(render_chunks()) for i in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return chunks.merge()
+
+    async def render_many(self, jobs, concurrency=8, ordered=False):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        jobs = _iterate_jobs(jobs)
+        running = set()
+        finished = {}
+        fetch = None
+        exhausted = False
+        next_index = 0
+        next_result = 0
+
+        try:
+            while True:
+                # Only pull the next job once there is room for it, so no more
+                # than `concurrency` pages are ever open at the same time
+                if fetch is None and not exhausted and len(running) < concurrency:
+                    fetch = asyncio.ensure_future(_next_job(jobs))
+
+                waiting = (running | {fetch}) if fetch else running
+                if not waiting:
+                    break
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if fetch in done:
+                    has_job, job = fetch.result()
+                    fetch = None
+                    if has_job:
+                        running.add(
+                            asyncio.ensure_future(self._render_job(next_index, job))
+                        )
+                        next_index += 1
+                    else:
+                        exhausted = True
+
+                for task in done & running:
+                    running.discard(task)
+                    result = task.result()
+                    if ordered:
+                        finished[result.index] = result
+                    else:
+                        yield result
+
+                while next_result in finished:
+                    yield finished.pop(next_result)
+                    next_result += 1
+        finally:
+            pending = (running | {fetch}) if fetch else running
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            await jobs.aclose()
+
+
+class HTMLToPDFConverter:
+    _browser = None
+
+    def __init__(
+        self,
+        launch_options={},
+        page_pool_size=0,
+        cache=None,
+        resource_cache=None,
+        load_options={},
+        recycle_options={},
+        hooks=[],
+        context_options={},
+        max_contexts=16,
+        endpoint=None,
+        optimize_options={},
+        max_template_pages=16,
+    ):
+        self._launch_options = launch_options
+        self._optimize_options = optimize_options
+        # Where the browser comes from, launched locally by default
+        self._endpoint = endpoint or {"launch": launch_options}
+        _split_endpoint(self._endpoint)
+        self._load_options = load_options
+        self._recycle_options = recycle_options
+        self._hooks = tuple(hooks)
+        self._page_pool_size = page_pool_size
+        self._cache = cache
+        self._resource_cache = resource_cache
+        self._browser = None
+        self._playwright = None
+        self._idle_pages = []
+        self._crashed_pages = set()
+        # Warm pages with a template loaded by template, least recently used
+        # first, see from_template
+        self._max_template_pages = max_template_pages
+        self._template_pages = collections.OrderedDict()
+        self._page_templates = {}
+        self._template_page_evictions = 0
+        self._page_pool_hits = 0
+        self._page_pool_misses = 0
+        self._page_pool_replaced = 0
+        self._browser_launched = 0
+        self._browser_renders = 0
+        self._next_memory_check = 0
+        self._browser_marker = None
+        self._browser_launches = 0
+        self._browser_recycles = 0
+        self._crash_retries = 0
+        # Browser contexts by key, least recently used first, see
+        # set_context_options
+        self._context_options = dict(context_options)
+        self._max_contexts = max_contexts
+        self._contexts = collections.OrderedDict()
+        self._context_pages = {}
+        self._context_jobs = collections.Counter()
+        self._retired_contexts = set()
+        self._context_hits = 0
+        self._context_misses = 0
+        self._context_evictions = 0
+
+    def init(self):
+        self._playwright = sync_playwright().start()
+        try:
+            self._browser = self._launch_browser()
+        except PlaywrightError as exc:
+            self._playwright.stop()
+            raise RuntimeError(
+                "An exception occurred while trying to launch browser"
+            ) from exc
+
+    def finish(self):
+        self._forget_idle_pages()
+        self._forget_contexts()
+        self._crashed_pages.clear()
+        self._browser.close()
+        self._playwright.stop()
+
+    def __enter__(self):
+        self.init()
+        return self
+
+    def __exit__(self, *args):
+        self.finish()
+
+    def _pdf_from_page(
+        self,
+        page,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        output_stream=None,
+        return_bytes=True,
+        optimize_options={},
+    ):
+        render_options = _pdf_options(header_html, footer_html, render_options)
+        if optimize_options:
+            return self._optimized_pdf_from_page(
+                page,
+                output_path,
+                render_options,
+                output_stream,
+                return_bytes,
+                optimize_options,
+            )
+        if output_stream is None and (return_bytes or not output_path):
+            if output_path:
+                render_options["path"] = output_path
+            pdf = page.pdf(**render_options)
+            if self._hooks:
+                self._emit("pdf_size", len(pdf))
+            return pdf
+
+        # Have chromium hand out the PDF in chunks and pass each one on right
+        # away, instead of holding the whole document in memory
+        params = _print_to_pdf_params(render_options)
+        with _open_output(output_path) as output_file:
+            sinks = [sink for sink in (output_file, output_stream) if sink is not None]
+            size = 0
+            session = page.context.new_cdp_session(page)
+            try:
+                result = session.send("Page.printToPDF", params)
+                while True:
+                    chunk = session.send(
+                        "IO.read",
+                        {"handle": result["stream"], "size": STREAM_CHUNK_SIZE},
+                    )
+                    data = _decode_chunk(chunk)
+                    size += len(data)
+                    for sink in sinks:
+                        _write_chunk(sink, data)
+                    if chunk["eof"]:
+                        break
+                session.send("IO.close", {"handle": result["stream"]})
+            finally:
+                session.detach()
+        if self._hooks:
+            self._emit("pdf_size", size)
+        return None
+
+    def _optimized_pdf_from_page(
+        self,
+        page,
+        output_path,
+        render_options,
+        output_stream,
+        return_bytes,
+        optimize_options,
+    ):
+        # Optimizing needs the whole PDF, so it's only streamed out afterwards.
+        # Only the optimized PDF may end up in a file, never the original one.
+        render_options.pop("path", None)
+        pdf = page.pdf(**render_options)
+        with self._timed("optimize"):
+            optimized = _optimize_pdf(pdf, optimize_options)
+        if self._hooks:
+            self._emit("pdf_size", len(optimized))
+            self._emit("optimize_savings", len(pdf) - len(optimized))
+        with _open_output(output_path) as output_file:
+            for sink in (output_file, output_stream):
+                if sink is not None:
+                    _write_chunk(sink, optimized)
+        if output_stream is None and (return_bytes or not output_path):
+            return optimized
+        return None
+
+    def _timed(self, event, error_event=None):
+        if not self._hooks:
+            return NO_TIMING
+        return _StageTimer(self._hooks, event, error_event)
+
+    def _emit(self, event, value=1):
+        for hook in self._hooks:
+            hook(event, value)
+
+    def _launch_browser(self):
+        kind, target, options = _split_endpoint(self._endpoint)
+        with self._timed("launch"):
+            if kind == "launch":
+                # Chromium ignores the unknown switch, it only tells this
+                # browser's processes apart from all others
+                self._browser_marker = f"--pyhtmltopdf-browser={uuid.uuid4().hex}"
+                options = DEFAULT_LAUNCH_OPTIONS | target
+                options["args"] = [*(options.get("args") or ()), self._browser_marker]
+                browser = self._playwright.chromium.launch(**options)
+            else:
+                browser = getattr(self._playwright.chromium, kind)(target, **options)
+        self._browser_launched = time.monotonic()
+        self._next_memory_check = self._browser_launched + MEMORY_CHECK_INTERVAL
+        self._browser_renders = 0
+        self._browser_launches += 1
+        return browser
+
+    def _close_browser(self, browser):
+        try:
+            browser.close()
+        except PlaywrightError:
+            pass
+
+    def _recycle_due(self):
+        max_renders = self._recycle_options.get("max_renders")
+        if max_renders and self._browser_renders >= max_renders:
+            return True
+        max_age = self._recycle_options.get("max_age")
+        if max_age and time.monotonic() - self._browser_launched >= max_age:
+            return True
+        # Only a local browser's memory usage can be measured
+        max_memory = self._recycle_options.get("max_memory")
+        if "launch" not in self._endpoint:
+            max_memory = None
+        if max_memory and time.monotonic() >= self._next_memory_check:
+            self._next_memory_check = time.monotonic() + MEMORY_CHECK_INTERVAL
+            memory = _browser_memory_usage(self._browser_marker)
+            if memory is not None and memory > max_memory:
+                return True
+        return False
+
+    def _ensure_browser(self):
+        if not self._browser.is_connected() or self._recycle_due():
+            if self._browser.is_connected():
+                self._browser_recycles += 1
+            self._forget_idle_pages()
+            self._forget_contexts()
+            self._close_browser(self._browser)
+            self._browser = self._launch_browser()
+        self._browser_renders += 1
+        return self._browser
+
+    def browser_stats(self):
+        return {
+            "launches": self._browser_launches,
+            "recycles": self._browser_recycles,
+            "crash_retries": self._crash_retries,
+            "renders": self._browser_renders,
+            "age": time.monotonic() - self._browser_launched,
+            "connected": self._browser.is_connected(),
+        }
+
+    def context_pool_stats(self):
+        return {
+            "size": len(self._contexts),
+            "max_size": self._max_contexts,
+            "in_use": len(self._context_jobs),
+            "hits": self._context_hits,
+            "misses": self._context_misses,
+            "evictions": self._context_evictions,
+        }
+
+    def set_context_options(self, key, options):
+        # Contexts created with the old options are not used for new jobs
+        self._context_options[key] = options
+        context = self._contexts.pop(key, None)
+        if context is not None:
+            self._retired_contexts.add(context)
+
+    def page_pool_stats(self):
+        return {
+            "size": len(self._idle_pages),
+            "max_size": self._page_pool_size,
+            "hits": self._page_pool_hits,
+            "misses": self._page_pool_misses,
+            "replaced": self._page_pool_replaced,
+            "template_pages": sum(map(len, self._template_pages.values())),
+            "max_template_pages": self._max_template_pages,
+            "template_evictions": self._template_page_evictions,
+        }
+
+    def _new_page(self, browser, context=None):
+        with self._timed("new_page"):
+            if context is None:
+                page = browser.new_page()
+            else:
+                page = context.new_page()
+        page.on("crash", self._crashed_pages.add)
+        # What a context fetches can depend on its credentials, so only pages
+        # without one share cached resources
+        if self._resource_cache is not None and context is None:
+            page.route(self._resource_cache.matches, self._serve_cached_resource)
+        return page
+
+    def _serve_cached_resource(self, route):
+        request = route.request
+        if request.method != "GET" or request.is_navigation_request():
+            route.fallback()
+            return
+
+        entry = self._resource_cache.get(request.url)
+        if entry is None:
+            try:
+                response = route.fetch()
+                body = response.body()
+            except PlaywrightError:
+                # Let chromium run into the same error on its own
+                route.fallback()
+                return
+            entry = (response.status, _resource_headers(response.headers), body)
+            if response.status == 200:
+                self._resource_cache.put(request.url, *entry)
+
+        status, headers, body = entry
+        route.fulfill(status=status, headers=headers, body=body)
+
+    def _discard_page(self, page):
+        self._crashed_pages.discard(page)
+        self._page_templates.pop(page, None)
+        try:
+            page.close()
+        except PlaywrightError:
+            pass
+
+    def _forget_contexts(self):
+        # The contexts die with their browser
+        self._contexts.clear()
+        self._context_pages = {}
+        self._retired_contexts.clear()
+
+    def _close_context(self, context):
+        for page in self._context_pages.pop(context, []):
+            self._crashed_pages.discard(page)
+            self._page_templates.pop(page, None)
+        try:
+            context.close()
+        except PlaywrightError:
+            pass
+
+    def _evict_contexts(self):
+        for context in list(self._retired_contexts):
+            if not self._context_jobs[context]:
+                self._retired_contexts.discard(context)
+                self._close_context(context)
+        # Contexts that are in use are never evicted, so the pool can be
+        # over its size until their jobs are done
+        for key, context in list(self._contexts.items()):
+            if len(self._contexts) <= self._max_contexts:
+                break
+            if not self._context_jobs[context]:
+                del self._contexts[key]
+                self._context_evictions += 1
+                self._close_context(context)
+
+    def _forget_idle_pages(self):
+        for pages in self._template_pages.values():
+            for page in pages:
+                self._page_templates.pop(page, None)
+        self._idle_pages = []
+        self._template_pages = collections.OrderedDict()
+
+    def _acquire_context(self, browser, key):
+        context = self._contexts.get(key)
+        if context is not None and context.browser is browser:
+            self._context_hits += 1
+        else:
+            # A context of a replaced browser died along with it
+            if context is not None:
+                self._context_pages.pop(context, None)
+            self._context_misses += 1
+            context = browser.new_context(**self._context_options.get(key, {}))
+            self._contexts[key] = context
+            self._context_pages[context] = []
+        self._contexts.move_to_end(key)
+        self._context_jobs[context] += 1
+        self._evict_contexts()
+        return context
+
+    def _context_done(self, context):
+        self._context_jobs[context] -= 1
+        if not self._context_jobs[context]:
+            del self._context_jobs[context]
+            self._evict_contexts()
+
+    def _acquire_page(self, browser, template=None, context=None):
+        idle_pages = self._idle_pages
+        if context is not None:
+            idle_pages = self._context_pages.get(context, [])
+        elif template is not None:
+            idle_pages = self._template_pages.get(template, [])
+        while idle_pages and browser is self._browser:
+            page = idle_pages.pop()
+            # Templates without warm pages aren't kept around
+            if not idle_pages and idle_pages is self._template_pages.get(template):
+                del self._template_pages[template]
+            if page not in self._crashed_pages and not page.is_closed():
+                self._page_pool_hits += 1
+                if self._hooks:
+                    self._emit("page_reused")
+                return page
+            self._page_pool_replaced += 1
+            self._discard_page(page)
+
+        if self._page_pool_size or template is not None or context is not None:
+            self._page_pool_misses += 1
+        return self._new_page(browser, context)
+
+    def _release_page(self, page, reuse=True):
+        with self._timed("close"):
+            self._recycle_page(page, reuse)
+
+    def _recycle_page(self, page, reuse):
+        if self._context_jobs[page.context]:
+            self._recycle_context_page(page, reuse)
+            return
+        template = self._page_templates.get(page)
+        if template is not None:
+            # Template pages are kept as they are, the next job overwrites
+            # the data anyway
+            if (
+                reuse
+                and len(self._template_pages.get(template, ()))
+                < max(self._page_pool_size, 1)
+                and page not in self._crashed_pages
+                and not page.is_closed()
+                and page.context.browser is self._browser
+            ):
+                self._template_pages.setdefault(template, []).append(page)
+                self._template_pages.move_to_end(template)
+                self._evict_template_pages()
+                return
+        elif (
+            reuse
+            and len(self._idle_pages) < self._page_pool_size
+            and page not in self._crashed_pages
+            and not page.is_closed()
+            and page.context.browser is self._browser
+        ):
+            # Wipe everything the last job left behind, so the next one starts
+            # with the same state as a freshly opened page
+            try:
+                page.evaluate(RESET_PAGE_STORAGE_SCRIPT)
+                page.goto("about:blank")
+                page.context.clear_cookies()
+            except PlaywrightError:
+                pass
+            else:
+                # Other pages may have been released in the meantime
+                if len(self._idle_pages) < self._page_pool_size:
+                    self._idle_pages.append(page)
+                    return
+        self._discard_page(page)
+
+    def _evict_template_pages(self):
+        # The pages of the least recently used templates are closed first
+        while sum(map(len, self._template_pages.values())) > self._max_template_pages:
+            template, pages = next(iter(self._template_pages.items()))
+            page = pages.pop(0)
+            if not pages:
+                del self._template_pages[template]
+            self._template_page_evictions += 1
+            self._discard_page(page)
+
+    def _recycle_context_page(self, page, reuse):
+        # Pages only ever go back to the pool of their own context, and keep
+        # its cookies and storage
+        self._page_templates.pop(page, None)
+        idle_pages = self._context_pages.get(page.context)
+        if (
+            reuse
+            and idle_pages is not None
+            and len(idle_pages) < max(self._page_pool_size, 1)
+            and page not in self._crashed_pages
+            and not page.is_closed()
+            and page.context.browser is self._browser
+        ):
+            try:
+                page.goto("about:blank")
+            except PlaywrightError:
+                pass
+            else:
+                # Other pages may have been released in the meantime, or the
+                # context closed
+                if self._context_pages.get(page.context) is idle_pages and len(
+                    idle_pages
+                ) < max(self._page_pool_size, 1):
+                    idle_pages.append(page)
+                    return
+        self._discard_page(page)
+
+    def _load_url(self, page, load_options, deadline, url):
+        page.goto(
+            url,
+            wait_until=load_options["wait_until"],
+            timeout=_remaining_timeout(deadline),
+        )
+
+    def _load_string(self, page, load_options, deadline, string, base_url):
+        if base_url is not None and base_url.lower().startswith("file:"):
+            # file:// URLs can't be routed, so the document is written into
+            # the page of its directory instead. That gives it access to local
+            # files and resolves relative links against the directory.
+            page.goto(
+                _directory_url(base_url),
+                wait_until="domcontentloaded",
+                timeout=_remaining_timeout(deadline),
+            )
+            base_url = None
+        if base_url is None:
+            page.set_content(
+                string,
+                wait_until=load_options["wait_until"],
+                timeout=_remaining_timeout(deadline),
+            )
+            return
+
+        # Pretend the document lives at base_url, so relative links resolve
+        # against it, but serve it straight from memory
+        document_url = _document_url(base_url)
+
+        def is_document(url):
+            return url == document_url
+
+        def serve_document(route):
+            if _is_main_document(route.request):
+                route.fulfill(body=string, content_type="text/html; charset=utf-8")
+            else:
+                route.fallback()
+
+        page.route(is_document, serve_document)
+        try:
+            page.goto(
+                document_url,
+                wait_until=load_options["wait_until"],
+                timeout=_remaining_timeout(deadline),
+            )
+        finally:
+            page.unroute(is_document, serve_document)
+
+    def _load_string_with_assets(
+        self, page, load_options, deadline, string, base_url, assets, virtual
+    ):
+        document_url = _document_url(base_url)
+        prefix = document_url[: document_url.rindex("/") + 1]
+
+        def is_asset(url):
+            return url.startswith(prefix)
+
+        def serve_asset(route):
+            path = _asset_path(route.request.url, prefix)
+            if not path or _is_main_document(route.request):
+                route.fallback()
+                return
+            try:
+                body = assets(path) if callable(assets) else assets.get(path)
+            except Exception:
+                route.abort()
+                return
+            if body is not None:
+                route.fulfill(body=body, content_type=_asset_content_type(path))
+            elif virtual:
+                route.fulfill(status=404)
+            else:
+                route.fallback()
+
+        # The assets stay routed until the PDF is done, since printing can
+        # still load images for print styles
+        page.route(is_asset, serve_asset)
+        self._load_string(page, load_options, deadline, string, base_url)
+        return functools.partial(page.unroute, is_asset, serve_asset)
+
+    def _load_template(self, page, load_options, deadline, template, data):
+        string, base_url, render_function = template
+        if page not in self._page_templates:
+            self._load_string(page, load_options, deadline, string, base_url)
+            self._page_templates[page] = template
+        page.evaluate(render_function, data)
+
+    def _load_parts(self, page, load_options, deadline, parts, base_url, bookmarks):
+        self._load_string(page, load_options, deadline, PARTS_DOCUMENT, base_url)
+        # Only one part at a time is held in memory, the browser keeps the rest
+        for string, title in _iterate_parts(parts):
+            page.evaluate(APPEND_PART_SCRIPT, [string, title, bookmarks])
+        page.wait_for_function(PARTS_READY_SCRIPT, timeout=_remaining_timeout(deadline))
+
+    def _wait_until_ready(self, page, load_options, deadline):
+        if load_options.get("wait_for_selector"):
+            page.wait_for_selector(
+                load_options["wait_for_selector"],
+                state="attached",
+                timeout=_remaining_timeout(deadline),
+            )
+        if load_options.get("wait_for_function"):
+            page.wait_for_function(
+                load_options["wait_for_function"],
+                timeout=_remaining_timeout(deadline),
+            )
+        if load_options.get("wait_for_fonts"):
+            page.wait_for_function(
+                FONTS_READY_SCRIPT, timeout=_remaining_timeout(deadline)
+            )
+
+    def _block_resources(self, page, load_options):
+        resource_types = set(load_options.get("block_resource_types") or ())
+        url_patterns = load_options.get("block_url_patterns") or ()
+        if not resource_types and not url_patterns:
+            return None
+
+        def block(route):
+            request = route.request
+            if not _is_main_document(request) and (
+                request.resource_type in resource_types
+                or _url_matches(request.url, url_patterns)
+            ):
+                route.abort("blockedbyclient")
+            else:
+                route.fallback()
+
+        page.route("**/*", block)
+        return block
+
+    def _measure_layout(self, page, pdf_options, warnings):
+        width, height = _printable_area(pdf_options)
+        viewport = page.viewport_size
+        page.emulate_media(media="print")
+        page.set_viewport_size({"width": width, "height": height})
+        try:
+            layout = page.evaluate(
+                PREFLIGHT_SCRIPT, [width, height, MAX_PREFLIGHT_ELEMENTS]
+            )
+        finally:
+            # The page goes back to how it was, so it can be printed right away
+            page.emulate_media(media="null")
+            if viewport is not None:
+                page.set_viewport_size(viewport)
+        return {
+            "page_count": layout["pageCount"],
+            "page_size": {"width": width, "height": height},
+            "overflowing": layout["overflowing"],
+            "warnings": warnings + layout["warnings"],
+        }
+
+    def _render_page(
+        self,
+        page,
+        load,
+        load_options,
+        deadline,
+        output_path,
+        header_html,
+        footer_html,
+        render_options,
+        output_stream,
+        return_bytes,
+        optimize_options,
+        preflight=None,
+        dependencies=None,
+    ):
+        if dependencies is not None:
+            stop_recording = _collect_dependencies(page, dependencies)
+        block = self._block_resources(page, load_options)
+        if preflight is not None:
+            warnings, stop_collecting = _collect_warnings(page)
+        try:
+            with self._timed("goto"):
+                unroute = load(page, load_options, deadline)
+            with self._timed("wait"):
+                self._wait_until_ready(page, load_options, deadline)
+        finally:
+            if preflight is not None:
+                stop_collecting()
+
+        if preflight is not None:
+            with self._timed("preflight"):
+                report = self._measure_layout(
+                    page,
+                    _pdf_options(header_html, footer_html, render_options),
+                    warnings,
+                )
+            changes = preflight(report)
+            if changes:
+                render_options = render_options | changes
+
+        pdf = None
+        if preflight is None or changes is not False:
+            with self._timed("pdf"):
+                pdf = self._pdf_from_page(
+                    page,
+                    output_path,
+                    header_html,
+                    footer_html,
+                    render_options,
+                    output_stream,
+                    return_bytes,
+                    optimize_options,
+                )
+        if block is not None:
+            page.unroute("**/*", block)
+        if unroute is not None:
+            unroute()
+        if dependencies is not None:
+            stop_recording()
+        return pdf
+
+    def _from_page(self, *args, **kwargs):
+        with self._timed("render", "error"):
+            return self._convert(*args, **kwargs)
+
+    def _convert(
+        self,
+        load,
+        identity,
+        template,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        output_stream=None,
+        return_bytes=True,
+        load_options={},
+        retry=True,
+        context=None,
+        optimize_options=None,
+        preflight=None,
+        dependencies=None,
+    ):
+        load_options = DEFAULT_LOAD_OPTIONS | self._load_options | load_options
+        if optimize_options is None:
+            optimize_options = self._optimize_options
+        deadline = None
+        if load_options.get("timeout") is not None:
+            deadline = time.monotonic() + load_options["timeout"] / 1000
+        streaming = output_stream is not None or (output_path and not return_bytes)
+
+        # Whatever the preflight decides isn't part of the cache key, and a
+        # cached PDF doesn't tell which files it was rendered from
+        cache_key = None
+        if (
+            self._cache is not None
+            and identity is not None
+            and preflight is None
+            and dependencies is None
+        ):
+            if context is not None:
+                identity = [identity, context]
+            if optimize_options:
+                identity = [identity, optimize_options]
+            cache_key = _cache_key(
+                identity, header_html, footer_html, render_options, load_options
+            )
+            pdf = self._cache.get(cache_key)
+            if pdf is not None:
+                if self._hooks:
+                    self._emit("cache_hit")
+                if output_path:
+                    with open(output_path, "wb") as f:
+                        f.write(pdf)
+                if output_stream is not None:
+                    _write_chunk(output_stream, pdf)
+                return None if streaming else pdf
+
+        # A crashed browser is relaunched and the job is retried on it, unless
+        # some of the PDF was already streamed to the caller
+        retries = self._recycle_options.get("retries", 1)
+        if output_stream is not None or not retry:
+            retries = 0
+        for attempt in itertools.count():
+            browser = self._ensure_browser()
+            browser_context = None
+            page = None
+            try:
+                if context is not None:
+                    browser_context = self._acquire_context(browser, context)
+                page = self._acquire_page(browser, template, browser_context)
+                pdf = self._render_page(
+                    page,
+                    load,
+                    load_options,
+                    deadline,
+                    output_path,
+                    header_html,
+                    footer_html,
+                    render_options,
+                    output_stream,
+                    return_bytes,
+                    optimize_options,
+                    preflight,
+                    dependencies,
+                )
+            except BaseException as exc:
+                crashed = not browser.is_connected() or page in self._crashed_pages
+                if page is not None:
+                    self._release_page(page, reuse=False)
+                if browser_context is not None:
+                    self._context_done(browser_context)
+                if not (
+                    isinstance(exc, PlaywrightError) and crashed and attempt < retries
+                ):
+                    raise
+                self._crash_retries += 1
+                if self._hooks:
+                    self._emit("crash_retry")
+                continue
+            self._release_page(page)
+            if browser_context is not None:
+                self._context_done(browser_context)
+            break
+
+        if cache_key is not None and pdf is not None:
+            self._cache.put(cache_key, pdf)
+        return pdf
+
+    def from_file(self, file_path, *args, **kwargs):
+        file_path = realpath(file_path)
+        load = functools.partial(self._load_url, url="file://" + file_path)
+        identity = _file_identity(file_path) if self._cache is not None else None
+        return self._from_page(load, identity, None, *args, **kwargs)
+
+    def from_url(self, url, *args, cache_version=None, **kwargs):
+        load = functools.partial(self._load_url, url=url)
+        # Only the caller knows when the content behind a URL changes
+        identity = None if cache_version is None else f"url:{url}:{cache_version}"
+        return self._from_page(load, identity, None, *args, **kwargs)
+
+    def from_string(self, string, *args, base_url=None, assets=None, **kwargs):
+        identity = None
+        if assets is not None:
+            # Whatever the assets contain is unknown, so this can't be cached
+            load = functools.partial(
+                self._load_string_with_assets,
+                string=string,
+                base_url=base_url or VIRTUAL_BASE_URL,
+                assets=assets,
+                virtual=base_url is None,
+            )
+        else:
+            load = functools.partial(
+                self._load_string, string=string, base_url=base_url
+            )
+            if self._cache is not None:
+                identity = _string_identity(string, base_url)
+        return self._from_page(load, identity, None, *args, **kwargs)
+
+    def from_template(
+        self,
+        template,
+        data,
+        *args,
+        base_url=None,
+        render_function=DEFAULT_RENDER_FUNCTION,
+        **kwargs,
+    ):
+        template = (template, base_url, render_function)
+        load = functools.partial(self._load_template, template=template, data=data)
+        identity = None
+        if self._cache is not None:
+            identity = _template_identity(template, data)
+        return self._from_page(load, identity, template, *args, **kwargs)
+
+    def from_parts(
+        self,
+        parts,
+        output_path=None,
+        header_html="",
+        footer_html="",
+        render_options={},
+        *args,
+        base_url=None,
+        bookmarks=False,
+        **kwargs,
+    ):
+        load = functools.partial(
+            self._load_parts, parts=parts, base_url=base_url, bookmarks=bookmarks
+        )
+        if bookmarks:
+            render_options = {"outline": True, "tagged": True} | render_options
+        # A generator of parts can only be gone through once
+        retry = iter(parts) is not parts
+        return self._from_page(
+            load,
+            None,
+            None,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            *args,
+            retry=retry,
+            **kwargs,
+        )
+
+    def preflight(self, job):
+        reports = []
+
+        def measured(report):
+            reports.append(report)
+            return False
+
+        method, source, kwargs = _split_job(job)
+        getattr(self, method)(source, preflight=measured, **kwargs)
+        return reports[-1]
+
+
+def _picklable_error(exc):
+    try:
+        pickle.dumps(exc)
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+    return exc
+
+
+def _process_pool_worker(connection, launch_options, converter_options):
+    converter = HTMLToPDFConverter(launch_options, **converter_options)
+    try:
+        converter.init()
+    except Exception as exc:
+        connection.send(("failed", _picklable_error(exc)))
+        return
+    connection.send(("ready", None))
+
+    try:
+        while True:
+            try:
+                item = connection.recv()
+            except EOFError:
+                break
+            if item is None:
+                break
+
+            job, return_path = item
+            try:
+                method, source, kwargs = _split_job(job)
+                pdf = getattr(converter, method)(source, **kwargs)
+            except Exception as exc:
+                connection.send(("error", _picklable_error(exc)))
+            else:
+                if return_path and kwargs.get("output_path"):
+                    pdf = kwargs["output_path"]
+                connection.send(("done", pdf))
+    finally:
+        converter.finish()
+
+
+class ProcessPoolConverter:
+    def __init__(
+        self,
+        workers=None,
+        launch_options={},
+        return_paths=False,
+        mp_context="spawn",
+        **converter_options,
+    ):
+        self._workers = workers or os.cpu_count() or 1
         self._launch_options = launch_options
-        self._browser = None
-        self._playwright = None
+        self._return_paths = return_paths
+        self._mp_context = multiprocessing.get_context(mp_context)
+        self._converter_options = converter_options
+        self._processes = []
+        self._connections = []
+        self._assigned = []
+        self._ready = []
+        self._pending = collections.deque()
+        self._futures = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._stopping = False
+        self._retired = set()
+        self._launch_error = None
 
-    async def init(self):
-        self._playwright = await async_playwright().start()
+    def _start_worker(self, worker_index):
+        connection, child_connection = self._mp_context.Pipe()
+        process = self._mp_context.Process(
+            target=_process_pool_worker,
+            args=(child_connection, self._launch_options, self._converter_options),
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        self._processes[worker_index] = process
+        self._connections[worker_index] = connection
+        self._assigned[worker_index] = None
+        self._ready[worker_index] = False
 
-        try:
-            self._browser = await self._playwright.chromium.launch(
-                **(DEFAULT_LAUNCH_OPTIONS | self._launch_options)
-            )
-        except playwright._impl._api_types.Error as exc:
-            await self._playwright.stop()
+    def init(self):
+        self._stopping = False
+        self._retired = set()
+        self._processes = [None] * self._workers
+        self._connections = [None] * self._workers
+        self._assigned = [None] * self._workers
+        self._ready = [False] * self._workers
+        for worker_index in range(self._workers):
+            self._start_worker(worker_index)
+
+        # Wait for every worker to have its browser up, just like
+        # HTMLToPDFConverter.init() only returns once chromium is running
+        errors = []
+        for process, connection in zip(self._processes, self._connections):
+            try:
+                status, error = connection.recv()
+            except EOFError:
+                process.join()
+                status = "failed"
+                error = RuntimeError(
+                    f"Worker process exited with code {process.exitcode}"
+                )
+            if status == "failed":
+                errors.append(error)
+        if errors:
+            self._stop_workers()
             raise RuntimeError(
                 "An exception occurred while trying to launch browser"
-            ) from exc
+            ) from errors[0]
+
+        self._ready = [True] * self._workers
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _stop_workers(self):
+        for worker_index, connection in enumerate(self._connections):
+            if worker_index in self._retired:
+                continue
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker_index, process in enumerate(self._processes):
+            if worker_index in self._retired:
+                continue
+            process.join()
+            self._connections[worker_index].close()
+        self._processes = []
+        self._connections = []
+
+    def finish(self):
+        # Let every submitted job finish before the browsers go away
+        with self._lock:
+            futures = [future for future, _ in self._futures.values()]
+        concurrent.futures.wait(futures)
+
+        self._stopping = True
+        self._collector.join()
+        self._collector = None
+        self._stop_workers()
+
+    def __enter__(self):
+        self.init()
+        return self
+
+    def __exit__(self, *args):
+        self.finish()
+
+    def _dispatch(self):
+        # Must be called with self._lock held. Jobs wait in one shared queue
+        # and go to whichever worker becomes idle first, so a slow document
+        # never holds up the jobs behind it.
+        for worker_index in range(self._workers):
+            while (
+                self._pending
+                and self._ready[worker_index]
+                and self._assigned[worker_index] is None
+            ):
+                job_id = self._pending.popleft()
+                future, job = self._futures[job_id]
+                if not future.set_running_or_notify_cancel():
+                    del self._futures[job_id]
+                    continue
+                self._connections[worker_index].send((job, self._return_paths))
+                self._assigned[worker_index] = job_id
+
+    def _collect(self):
+        while not self._stopping:
+            with self._lock:
+                waitables = {}
+                for worker_index, process in enumerate(self._processes):
+                    if worker_index in self._retired:
+                        continue
+                    waitables[self._connections[worker_index]] = worker_index
+                    waitables[process.sentinel] = worker_index
+
+            for waitable in multiprocessing.connection.wait(waitables, timeout=0.5):
+                worker_index = waitables[waitable]
+                with self._lock:
+                    if waitable is self._connections[worker_index]:
+                        self._handle_message(worker_index)
+                    elif waitable == self._processes[worker_index].sentinel:
+                        self._replace_worker(worker_index)
+                    self._dispatch()
+
+    def _handle_message(self, worker_index):
+        try:
+            status, value = self._connections[worker_index].recv()
+        except EOFError:
+            # The worker died, its sentinel takes care of the rest
+            return
+
+        if status == "ready":
+            self._ready[worker_index] = True
+        elif status == "failed":
+            # The worker exits right after, and its sentinel retires it
+            self._launch_error = value
+        else:
+            job_id = self._assigned[worker_index]
+            self._assigned[worker_index] = None
+            future, _ = self._futures.pop(job_id)
+            if status == "done":
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _replace_worker(self, worker_index):
+        process = self._processes[worker_index]
+        process.join()
+        self._connections[worker_index].close()
+
+        if not self._ready[worker_index]:
+            # A replacement worker could not launch its browser, retrying
+            # would most likely fail the same way
+            self._retired.add(worker_index)
+            if len(self._retired) == self._workers:
+                self._fail_pending()
+            return
+
+        job_id = self._assigned[worker_index]
+        if job_id is not None:
+            future, _ = self._futures.pop(job_id)
+            future.set_exception(
+                RuntimeError(
+                    f"Worker process exited with code {process.exitcode} "
+                    "while rendering"
+                )
+            )
+        self._start_worker(worker_index)
+
+    def _fail_pending(self):
+        while self._pending:
+            future, _ = self._futures.pop(self._pending.popleft())
+            if future.set_running_or_notify_cancel():
+                error = RuntimeError("No worker process is able to launch a browser")
+                future.set_exception(error)
+                error.__cause__ = self._launch_error
+
+    def submit(self, job):
+        _split_job(job)
+        future = concurrent.futures.Future()
+        with self._lock:
+            job_id = next(self._job_ids)
+            self._futures[job_id] = (future, job)
+            self._pending.append(job_id)
+            if len(self._retired) == self._workers:
+                self._fail_pending()
+            self._dispatch()
+        return future
+
+    def _call(self, key, source, args, kwargs):
+        job = dict(zip(PDF_ARGUMENTS, args)) | kwargs
+        job[key] = source
+        return self.submit(job).result()
+
+    def from_file(self, file_path, *args, **kwargs):
+        return self._call("file_path", realpath(file_path), args, kwargs)
+
+    def from_url(self, url, *args, **kwargs):
+        return self._call("url", url, args, kwargs)
+
+    def from_string(self, string, *args, **kwargs):
+        return self._call("string", string, args, kwargs)
+
+    def render_chunked(self, job, chunk_pages=50):
+        # Works like AHTMLToPDFConverter.render_chunked, with one chunk per
+        # worker process at a time
+        chunks = _Chunks(job, chunk_pages)
+        running = {}
+        try:
+            while True:
+                while len(running) < self._workers:
+                    index, chunk = chunks.next_job()
+                    if chunk is None:
+                        break
+                    running[self.submit(chunk)] = index
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    index = running.pop(future)
+                    if future.exception() is None:
+                        chunks.done(index, future.result())
+                    else:
+                        chunks.failed(index, future.exception())
+        finally:
+            for future in running:
+                future.cancel()
+        return chunks.merge()
+
+    def render_many(self, jobs, ordered=False):
+        # Only keep a couple of jobs per worker queued, instead of pickling
+        # the whole job list up front
+        max_queued = self._workers * 2
+        jobs = iter(jobs)
+        running = {}
+        finished = {}
+        next_index = 0
+        next_result = 0
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(running) < max_queued:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    try:
+                        future = self.submit(job)
+                    except Exception as exc:
+                        future = concurrent.futures.Future()
+                        future.set_exception(exc)
+                    running[future] = (next_index, job)
+                    next_index += 1
+
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    index, job = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        result = RenderResult(index, job, pdf=future.result())
+                    else:
+                        result = RenderResult(index, job, error=error)
+                    if ordered:
+                        finished[index] = result
+                    else:
+                        yield result
+
+                while next_result in finished:
+                    yield finished.pop(next_result)
+                    next_result += 1
+        finally:
+            for future in running:
+                future.cancel()
+
+
+class _EventLoopThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="pyhtmltopdf-event-loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class _Endpoint:
+    def __init__(self, index, endpoint, converter_options):
+        self.index = index
+        self.kind, target, _ = _split_endpoint(endpoint)
+        self.url = None if self.kind == "launch" else target
+        self.converter = AHTMLToPDFConverter(endpoint=endpoint, **converter_options)
+        self.started = False
+        self.healthy = False
+        self.outstanding = 0
+        self.renders = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def stats(self):
+        return {
+            "index": self.index,
+            "kind": self.kind,
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "renders": self.renders,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class ALoadBalancedConverter:
+    # Spreads the jobs over several browsers, each one driven by an
+    # AHTMLToPDFConverter of its own
+    def __init__(self, endpoints, health_check_interval=10, **converter_options):
+        if not endpoints:
+            raise ValueError("At least one endpoint is needed")
+        self._endpoints = [
+            _Endpoint(index, endpoint, converter_options)
+            for index, endpoint in enumerate(endpoints)
+        ]
+        self._health_check_interval = health_check_interval
+        self._health_checks = None
+
+    async def init(self):
+        await asyncio.gather(*(self._check(endpoint) for endpoint in self._endpoints))
+        if not any(endpoint.healthy for endpoint in self._endpoints):
+            await self._stop_converters()
+            raise RuntimeError("None of the browser endpoints could be reached")
+        self._health_checks = asyncio.ensure_future(self._check_health())
+
+    async def _stop_converters(self):
+        for endpoint in self._endpoints:
+            if endpoint.started:
+                endpoint.started = endpoint.healthy = False
+                await endpoint.converter.finish()
 
     async def finish(self):
-        await self._browser.close()
-        await self._playwright.stop()
+        self._health_checks.cancel()
+        await asyncio.gather(self._health_checks, return_exceptions=True)
+        self._health_checks = None
+        await self._stop_converters()
 
     async def __aenter__(self):
         await self.init()
@@ -43,63 +3588,284 @@ class AHTMLToPDFConverter:
     async def __aexit__(self, *args):
         await self.finish()
 
-    async def _pdf_from_page(
-        self, page, output_path=None, header_html="", footer_html="", render_options={}
-    ):
-        render_options = {
-            "display_header_footer": header_html != "" or footer_html != "",
-            "header_template": header_html,
-            "footer_template": footer_html,
-            "format": "A4",
-        } | render_options
-        if output_path:
-            render_options["path"] = output_path
-        return await page.pdf(**render_options)
+    def endpoint_stats(self):
+        return [endpoint.stats() for endpoint in self._endpoints]
 
-    async def from_file(self, file_path, *args, **kwargs):
-        page = await self._browser.new_page()
-        await page.goto("file://" + realpath(file_path), wait_until="load")
-        pdf = await self._pdf_from_page(page, *args, **kwargs)
-        await page.close()
-        return pdf
+    async def _check(self, endpoint):
+        try:
+            if not endpoint.started:
+                await endpoint.converter.init()
+                endpoint.started = True
+            # Goes through the whole render path, which also reconnects to
+            # the browser if the connection was lost
+            await endpoint.converter.from_url(
+                "about:blank", load_options=HEALTH_CHECK_LOAD_OPTIONS
+            )
+        except (RuntimeError, PlaywrightError):
+            return
+        endpoint.healthy = True
 
-    async def from_url(self, url, *args, **kwargs):
-        page = await self._browser.new_page()
-        await page.goto(url, wait_until="load")
-        pdf = await self._pdf_from_page(page, *args, **kwargs)
-        await page.close()
-        return pdf
+    async def _check_health(self):
+        # Ejected endpoints are put back into rotation once they work again
+        while True:
+            await asyncio.sleep(self._health_check_interval)
+            await asyncio.gather(
+                *(
+                    self._check(endpoint)
+                    for endpoint in self._endpoints
+                    if not endpoint.healthy
+                )
+            )
 
-    async def from_string(self, string, *args, **kwargs):
-        with tempfile.NamedTemporaryFile(suffix=".html", delete=True) as f:
-            f.write(string.encode())
-            f.flush()
-            return await self.from_file(f.name, *args, **kwargs)
+    def _pick(self, failed):
+        endpoints = [
+            endpoint
+            for endpoint in self._endpoints
+            if endpoint.healthy and endpoint not in failed
+        ]
+        if not endpoints:
+            return None
+        # Least outstanding jobs, ties go to the one that rendered the least
+        return min(
+            endpoints, key=lambda endpoint: (endpoint.outstanding, endpoint.renders)
+        )
 
+    async def _call(self, method, *args, **kwargs):
+        # A job on an endpoint that went away is retried on another one,
+        # unless some of the PDF was already streamed to the caller
+        failed = set()
+        while True:
+            endpoint = self._pick(failed)
+            if endpoint is None:
+                raise RuntimeError("None of the browser endpoints are healthy")
+            endpoint.outstanding += 1
+            endpoint.renders += 1
+            try:
+                return await getattr(endpoint.converter, method)(*args, **kwargs)
+            except Exception:
+                # Errors with the browser still connected are the document's
+                if endpoint.converter.browser_stats()["connected"]:
+                    raise
+                endpoint.failures += 1
+                if endpoint.healthy:
+                    endpoint.healthy = False
+                    endpoint.ejections += 1
+                failed.add(endpoint)
+                if kwargs.get("output_stream") is not None or not self._pick(failed):
+                    raise
+            finally:
+                endpoint.outstanding -= 1
 
-class HTMLToPDFConverter:
-    _browser = None
+    async def from_file(self, *args, **kwargs):
+        return await self._call("from_file", *args, **kwargs)
+
+    async def from_url(self, *args, **kwargs):
+        return await self._call("from_url", *args, **kwargs)
 
-    def __init__(self, launch_options={}):
+    async def from_string(self, *args, **kwargs):
+        return await self._call("from_string", *args, **kwargs)
+
+    async def from_template(self, *args, **kwargs):
+        return await self._call("from_template", *args, **kwargs)
+
+    async def from_parts(self, *args, **kwargs):
+        return await self._call("from_parts", *args, **kwargs)
+
+    # These only use the from_x methods, so they work the same here
+    _render_job = AHTMLToPDFConverter._render_job
+    render_chunked = AHTMLToPDFConverter.render_chunked
+    render_many = AHTMLToPDFConverter.render_many
+
+
+class ARenderScheduler:
+    # Decides which jobs get to run on a converter first. Jobs of a more
+    # urgent priority always go first, within a priority the callers take
+    # turns.
+    def __init__(
+        self,
+        converter,
+        concurrency=8,
+        priorities=("high", "normal", "low"),
+        default_priority="normal",
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if default_priority not in priorities:
+            raise ValueError(f"Unknown priority {default_priority!r}")
+        self._converter = converter
+        self._concurrency = concurrency
+        self._priorities = tuple(priorities)
+        self._default_priority = default_priority
+        self._running = 0
+        # Futures of the waiting jobs, by priority and then by caller. The
+        # caller whose turn it is comes first.
+        self._waiting = {
+            priority: collections.OrderedDict() for priority in self._priorities
+        }
+        self._started = collections.Counter()
+        self._expired = collections.Counter()
+        self._wait_times = {
+            priority: _Histogram(DEFAULT_TIME_BUCKETS) for priority in self._priorities
+        }
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "concurrency": self._concurrency,
+            "priorities": {
+                priority: {
+                    "queued": sum(map(len, self._waiting[priority].values())),
+                    "started": self._started[priority],
+                    "expired": self._expired[priority],
+                    "wait_time": self._wait_times[priority].snapshot(),
+                }
+                for priority in self._priorities
+            },
+        }
+
+    def _next_waiter(self):
+        for callers in self._waiting.values():
+            while callers:
+                caller, waiters = callers.popitem(last=False)
+                waiter = waiters.popleft()
+                if waiters:
+                    # Back in line behind the other callers
+                    callers[caller] = waiters
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _start_next(self):
+        while self._running < self._concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._running += 1
+            waiter.set_result(None)
+
+    def _expire(self, waiter, priority):
+        if not waiter.done():
+            self._expired[priority] += 1
+            waiter.set_exception(
+                asyncio.TimeoutError("The job did not start before its deadline")
+            )
+
+    def _forget_waiter(self, priority, caller, waiter):
+        waiters = self._waiting[priority].get(caller)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiting[priority][caller]
+
+    async def _acquire(self, priority, caller, deadline):
+        if priority not in self._waiting:
+            raise ValueError(f"Unknown priority {priority!r}")
+        queued = time.monotonic()
+        if deadline is not None and queued >= deadline:
+            self._expired[priority] += 1
+            raise asyncio.TimeoutError("The job did not start before its deadline")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiting[priority].setdefault(caller, collections.deque()).append(waiter)
+        self._start_next()
+        expiry = None
+        if deadline is not None and not waiter.done():
+            expiry = loop.call_later(deadline - queued, self._expire, waiter, priority)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled() and not waiter.exception():
+                # Got to start, but was cancelled at the same time
+                self._release()
+            else:
+                self._forget_waiter(priority, caller, waiter)
+            raise
+        finally:
+            if expiry is not None:
+                expiry.cancel()
+        self._started[priority] += 1
+        self._wait_times[priority].observe(time.monotonic() - queued)
+
+    def _release(self):
+        self._running -= 1
+        self._start_next()
+
+    async def _call(
+        self, method, *args, priority=None, caller=None, deadline=None, **kwargs
+    ):
+        await self._acquire(priority or self._default_priority, caller, deadline)
+        try:
+            return await getattr(self._converter, method)(*args, **kwargs)
+        finally:
+            self._release()
+
+    async def from_file(self, *args, **kwargs):
+        return await self._call("from_file", *args, **kwargs)
+
+    async def from_url(self, *args, **kwargs):
+        return await self._call("from_url", *args, **kwargs)
+
+    async def from_string(self, *args, **kwargs):
+        return await self._call("from_string", *args, **kwargs)
+
+    async def from_template(self, *args, **kwargs):
+        return await self._call("from_template", *args, **kwargs)
+
+    async def from_parts(self, *args, **kwargs):
+        return await self._call("from_parts", *args, **kwargs)
+
+    _render_job = AHTMLToPDFConverter._render_job
+    render_chunked = AHTMLToPDFConverter.render_chunked
+    render_many = AHTMLToPDFConverter.render_many
+
+
+class ThreadSafeConverter:
+    # A sync converter that any number of threads can share. The jobs all run
+    # on one AHTMLToPDFConverter, on an event loop thread of its own.
+    def __init__(
+        self, launch_options={}, concurrency=8, timeout=None, **converter_options
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
         self._launch_options = launch_options
-        self._browser = None
-        self._playwright = None
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._converter_options = converter_options
+        self._lock = threading.Lock()
+        self._loop_thread = None
+        self._futures = set()
+        # Only touched from the event loop thread
+        self._converter = None
+        self._semaphore = None
 
     def init(self):
-        self._playwright = sync_playwright().start()
-        try:
-            self._browser = self._playwright.chromium.launch(
-                **(DEFAULT_LAUNCH_OPTIONS) | self._launch_options
-            )
-        except playwright._impl._api_types.Error as exc:
-            self._playwright.stop()
-            raise RuntimeError(
-                "An exception occurred while trying to launch browser"
-            ) from exc
+        with self._lock:
+            self._loop_thread = _EventLoopThread()
+            try:
+                self._loop_thread.submit(self._start()).result()
+            except BaseException:
+                self._loop_thread.stop()
+                self._loop_thread = None
+                raise
+
+    async def _start(self):
+        self._converter = AHTMLToPDFConverter(
+            self._launch_options, **self._converter_options
+        )
+        await self._converter.init()
+        self._semaphore = asyncio.Semaphore(self._concurrency)
 
     def finish(self):
-        self._browser.close()
-        self._playwright.stop()
+        with self._lock:
+            loop_thread = self._loop_thread
+            self._loop_thread = None
+            futures = list(self._futures)
+        # Let every submitted job finish before the browser goes away
+        concurrent.futures.wait(futures)
+        loop_thread.submit(self._converter.finish()).result()
+        loop_thread.stop()
+        self._converter = None
 
     def __enter__(self):
         self.init()
@@ -108,38 +3874,188 @@ class HTMLToPDFConverter:
     def __exit__(self, *args):
         self.finish()
 
-    def _pdf_from_page(
-        self, page, output_path=None, header_html="", footer_html="", render_options={}
-    ):
-        render_options = {
-            "display_header_footer": header_html != "" or footer_html != "",
-            "header_template": header_html,
-            "footer_template": footer_html,
-            "format": "A4",
-        } | render_options
-        if output_path:
-            render_options["path"] = output_path
-        return page.pdf(**render_options)
+    def browser_stats(self):
+        return self._converter.browser_stats()
+
+    def page_pool_stats(self):
+        return self._converter.page_pool_stats()
+
+    def context_pool_stats(self):
+        return self._converter.context_pool_stats()
+
+    async def _render(self, method, source, kwargs):
+        async with self._semaphore:
+            return await getattr(self._converter, method)(source, **kwargs)
+
+    def submit(self, job):
+        # Cancelling the returned future cancels the job, even while it's
+        # being rendered
+        method, source, kwargs = _split_job(job)
+        with self._lock:
+            if self._loop_thread is None:
+                raise RuntimeError("The converter is not running")
+            future = self._loop_thread.submit(self._render(method, source, kwargs))
+            self._futures.add(future)
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _call(self, key, source, args, kwargs):
+        timeout = kwargs.pop("timeout", self._timeout)
+        job = dict(zip(PDF_ARGUMENTS, args)) | kwargs
+        job[key] = source
+        future = self.submit(job)
+        try:
+            return future.result(timeout)
+        finally:
+            # Nobody is waiting for the PDF anymore after a timeout, or when
+            # the calling thread was interrupted
+            future.cancel()
 
     def from_file(self, file_path, *args, **kwargs):
-        page = self._browser.new_page()
-        page.goto("file://" + realpath(file_path), wait_until="load")
-        pdf = self._pdf_from_page(page, *args, **kwargs)
-        page.close()
-        return pdf
+        return self._call("file_path", realpath(file_path), args, kwargs)
 
     def from_url(self, url, *args, **kwargs):
-        page = self._browser.new_page()
-        page.goto(url, wait_until="load")
-        pdf = self._pdf_from_page(page, *args, **kwargs)
-        page.close()
-        return pdf
+        return self._call("url", url, args, kwargs)
 
     def from_string(self, string, *args, **kwargs):
-        with tempfile.NamedTemporaryFile(suffix=".html", delete=True) as f:
-            f.write(string.encode())
-            f.flush()
-            return self.from_file(f.name, *args, **kwargs)
+        return self._call("string", string, args, kwargs)
+
+
+class _SharedBrowser:
+    def __init__(self, idle_timeout, converter_options):
+        self._idle_timeout = idle_timeout
+        self._converter_options = converter_options
+        self._lock = threading.Lock()
+        self._loop_thread = None
+        # Everything below is only touched from the event loop thread
+        self._converters = {}
+        self._active = 0
+        self._renders = set()
+        self._idle_handle = None
+        self._closing = None
+
+    def _reset_after_fork(self):
+        # The event loop thread and the browsers stay behind in the parent
+        self._lock = threading.Lock()
+        self._loop_thread = None
+        self._converters = {}
+        self._active = 0
+        self._renders = set()
+        self._idle_handle = None
+        self._closing = None
+
+    def submit(self, launch_options, method, *args, **kwargs):
+        with self._lock:
+            if self._loop_thread is None:
+                self._loop_thread = _EventLoopThread()
+            return self._loop_thread.submit(
+                self._render(launch_options, method, args, kwargs)
+            )
+
+    def render(self, *args, **kwargs):
+        return self.submit(*args, **kwargs).result()
+
+    async def arender(self, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(*args, **kwargs))
+
+    async def _start_converter(self, launch_options):
+        converter = AHTMLToPDFConverter(launch_options, **self._converter_options)
+        await converter.init()
+        return converter
+
+    async def _render(self, launch_options, method, args, kwargs):
+        key = json.dumps(launch_options, sort_keys=True, default=str)
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+        self._active += 1
+        self._renders.add(asyncio.current_task())
+        try:
+            # Concurrent calls wait for the same browser launch
+            if key not in self._converters:
+                self._converters[key] = asyncio.ensure_future(
+                    self._start_converter(launch_options)
+                )
+            try:
+                converter = await self._converters[key]
+            except Exception:
+                self._converters.pop(key, None)
+                raise
+            return await getattr(converter, method)(*args, **kwargs)
+        finally:
+            self._active -= 1
+            self._renders.discard(asyncio.current_task())
+            if not self._active and self._idle_timeout is not None:
+                self._idle_handle = asyncio.get_running_loop().call_later(
+                    self._idle_timeout, self._start_closing
+                )
+
+    def _start_closing(self):
+        self._idle_handle = None
+        self._closing = asyncio.ensure_future(self._close_idle())
+
+    async def _close_idle(self):
+        if self._active:
+            return
+        converters = self._converters
+        self._converters = {}
+        for starting in converters.values():
+            try:
+                converter = await starting
+            except Exception:
+                continue
+            await converter.finish()
+
+    async def _close_all(self):
+        # Renders that are still running get to finish first, and all of the
+        # browsers are closed before the event loop goes away
+        while self._renders:
+            await asyncio.gather(*self._renders, return_exceptions=True)
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self._closing is not None:
+            await asyncio.gather(self._closing, return_exceptions=True)
+        await self._close_idle()
+
+    def shutdown(self):
+        with self._lock:
+            if self._loop_thread is None:
+                return
+            self._loop_thread.submit(self._close_all()).result()
+            self._loop_thread.stop()
+            self._loop_thread = None
+
+
+_shared_browser = None
+
+
+def enable_shared_browser(idle_timeout=60, **converter_options):
+    global _shared_browser
+    disable_shared_browser()
+    _shared_browser = _SharedBrowser(idle_timeout, converter_options)
+
+
+def disable_shared_browser():
+    global _shared_browser
+    if _shared_browser is not None:
+        _shared_browser.shutdown()
+        _shared_browser = None
+
+
+def _reset_shared_browser_after_fork():
+    if _shared_browser is not None:
+        _shared_browser._reset_after_fork()
+
+
+atexit.register(disable_shared_browser)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_shared_browser_after_fork)
 
 
 async def afrom_file(
@@ -149,10 +4065,27 @@ async def afrom_file(
     footer_html="",
     launch_options={},
     render_options={},
+    load_options={},
 ):
+    if _shared_browser is not None:
+        return await _shared_browser.arender(
+            launch_options,
+            "from_file",
+            file_path,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
+        )
     async with AHTMLToPDFConverter(launch_options) as converter:
         return await converter.from_file(
-            file_path, output_path, header_html, footer_html, render_options
+            file_path,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
         )
 
 
@@ -163,10 +4096,27 @@ def from_file(
     footer_html="",
     launch_options={},
     render_options={},
+    load_options={},
 ):
+    if _shared_browser is not None:
+        return _shared_browser.render(
+            launch_options,
+            "from_file",
+            file_path,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
+        )
     with HTMLToPDFConverter(launch_options) as converter:
         return converter.from_file(
-            file_path, output_path, header_html, footer_html, render_options
+            file_path,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
         )
 
 
@@ -177,10 +4127,27 @@ async def afrom_url(
     footer_html="",
     launch_options={},
     render_options={},
+    load_options={},
 ):
+    if _shared_browser is not None:
+        return await _shared_browser.arender(
+            launch_options,
+            "from_url",
+            url,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
+        )
     async with AHTMLToPDFConverter(launch_options) as converter:
         return await converter.from_url(
-            url, output_path, header_html, footer_html, render_options
+            url,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
         )
 
 
@@ -191,10 +4158,27 @@ def from_url(
     footer_html="",
     launch_options={},
     render_options={},
+    load_options={},
 ):
+    if _shared_browser is not None:
+        return _shared_browser.render(
+            launch_options,
+            "from_url",
+            url,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
+        )
     with HTMLToPDFConverter(launch_options) as converter:
         return converter.from_url(
-            url, output_path, header_html, footer_html, render_options
+            url,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            load_options=load_options,
         )
 
 
@@ -205,10 +4189,33 @@ async def afrom_string(
     footer_html="",
     launch_options={},
     render_options={},
+    base_url=None,
+    load_options={},
+    assets=None,
 ):
+    if _shared_browser is not None:
+        return await _shared_browser.arender(
+            launch_options,
+            "from_string",
+            string,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            base_url=base_url,
+            load_options=load_options,
+            assets=assets,
+        )
     async with AHTMLToPDFConverter(launch_options) as converter:
         return await converter.from_string(
-            string, output_path, header_html, footer_html, render_options
+            string,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            base_url=base_url,
+            load_options=load_options,
+            assets=assets,
         )
 
 
@@ -219,8 +4226,606 @@ def from_string(
     footer_html="",
     launch_options={},
     render_options={},
+    base_url=None,
+    load_options={},
+    assets=None,
 ):
+    if _shared_browser is not None:
+        return _shared_browser.render(
+            launch_options,
+            "from_string",
+            string,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            base_url=base_url,
+            load_options=load_options,
+            assets=assets,
+        )
     with HTMLToPDFConverter(launch_options) as converter:
         return converter.from_string(
-            string, output_path, header_html, footer_html, render_options
+            string,
+            output_path,
+            header_html,
+            footer_html,
+            render_options,
+            base_url=base_url,
+            load_options=load_options,
+            assets=assets,
+        )
+
+
+# The job keys a render request may use. Everything that would touch the
+# file system of the server is left out.
+SERVER_JOB_KEYS = (
+    "string",
+    "url",
+    "template",
+    "data",
+    "base_url",
+    "render_function",
+    "header_html",
+    "footer_html",
+    "render_options",
+    "load_options",
+    "optimize_options",
+)
+
+
+def _http_head(status, content_type, content_length=None, headers={}):
+    lines = [
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+        f"Content-Type: {content_type}",
+        "Connection: close",
+    ]
+    if content_length is None:
+        lines.append("Transfer-Encoding: chunked")
+    else:
+        lines.append(f"Content-Length: {content_length}")
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+class _ChunkedResponse:
+    # Sends the PDF to the client while chromium produces it. The head of the
+    # response only goes out with the first chunk, so errors up until then
+    # can still be answered with a proper error response.
+    def __init__(self, writer):
+        self._writer = writer
+        self.started = False
+
+    async def write(self, data):
+        if not self.started:
+            self.started = True
+            self._writer.write(_http_head(200, "application/pdf"))
+        if data:
+            self._writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await self._writer.drain()
+
+    async def close(self):
+        await self.write(b"")
+        self._writer.write(b"0\r\n\r\n")
+        await self._writer.drain()
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, message, headers={}):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class RenderServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8000,
+        concurrency=8,
+        max_queue_size=64,
+        timeout=60,
+        max_request_size=16 * 1024 * 1024,
+        **converter_options,
+    ):
+        self._host = host
+        self._port = port
+        self._concurrency = concurrency
+        self._max_queue_size = max_queue_size
+        self._timeout = timeout
+        self._max_request_size = max_request_size
+        self._metrics = RenderMetrics()
+        self._converter_options = converter_options | {
+            "hooks": [*converter_options.get("hooks", []), self._metrics],
+        }
+        self._converter = None
+        self._server = None
+        self._slots = None
+        # Requests that are either running or waiting for their turn
+        self._admitted = 0
+        self._running = 0
+        self._responses = collections.Counter()
+
+    async def start(self):
+        self._converter = AHTMLToPDFConverter(**self._converter_options)
+        await self._converter.init()
+        self._slots = asyncio.Semaphore(self._concurrency)
+        self._server = await asyncio.start_server(
+            self._handle_connection, self._host, self._port
+        )
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._converter.finish()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def serve_forever(self):
+        async with self:
+            await self._server.serve_forever()
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()[:2]
+
+    def stats(self):
+        return {
+            "queued": self._admitted - self._running,
+            "running": self._running,
+            "responses": dict(self._responses),
+        }
+
+    def _prometheus(self):
+        lines = [
+            "# TYPE pyhtmltopdf_server_responses_total counter",
+            *(
+                f'pyhtmltopdf_server_responses_total{{status="{status}"}} {count}'
+                for status, count in sorted(self._responses.items())
+            ),
+            "# TYPE pyhtmltopdf_server_queued gauge",
+            f"pyhtmltopdf_server_queued {self._admitted - self._running}",
+            "# TYPE pyhtmltopdf_server_running gauge",
+            f"pyhtmltopdf_server_running {self._running}",
+        ]
+        return self._metrics.prometheus() + "\n".join(lines) + "\n"
+
+    async def _send(self, writer, status, body, content_type, headers={}):
+        self._responses[status] += 1
+        writer.write(_http_head(status, content_type, len(body), headers) + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, value, headers={}):
+        body = json.dumps(value).encode()
+        await self._send(writer, status, body, "application/json", headers)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            await self._handle_request(reader, writer)
+        except _HTTPError as exc:
+            await self._send_json(writer, exc.status, {"error": str(exc)}, exc.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _read_request(self, reader):
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            raise _HTTPError(400, "Malformed request")
+        return method, urllib.parse.urlsplit(target).path, headers
+
+    async def _read_job(self, reader, headers):
+        if "content-length" not in headers:
+            raise _HTTPError(411, "Content-Length required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise _HTTPError(400, "Invalid Content-Length")
+        if length > self._max_request_size:
+            raise _HTTPError(413, "Request too large")
+        try:
+            job = json.loads(await reader.readexactly(length))
+        except ValueError as exc:
+            raise _HTTPError(400, f"Invalid JSON: {exc}")
+
+        if not isinstance(job, dict):
+            raise _HTTPError(400, "Expected a JSON object")
+        timeout = job.pop("timeout", self._timeout)
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise _HTTPError(400, "timeout must be a positive number")
+        unknown = set(job) - set(SERVER_JOB_KEYS)
+        if unknown:
+            raise _HTTPError(400, "Unknown keys: " + ", ".join(sorted(unknown)))
+        for key in ("render_options", "load_options", "optimize_options"):
+            if not isinstance(job.get(key, {}), dict):
+                raise _HTTPError(400, f"{key} must be a JSON object")
+        # page.pdf() would write the PDF to the path on the server
+        if "path" in job.get("render_options", {}):
+            raise _HTTPError(400, "render_options can't contain a path")
+        try:
+            _split_job(job)
+        except ValueError as exc:
+            raise _HTTPError(400, str(exc))
+        if "url" in job and urllib.parse.urlsplit(job["url"]).scheme not in (
+            "http",
+            "https",
+        ):
+            raise _HTTPError(400, "Only http and https URLs can be rendered")
+        # A file:// base_url would give the document access to local files
+        base_url = job.get("base_url")
+        if base_url is not None and urllib.parse.urlsplit(str(base_url)).scheme not in (
+            "http",
+            "https",
+        ):
+            raise _HTTPError(400, "base_url has to be an http or https URL")
+        return job, timeout
+
+    async def _handle_request(self, reader, writer):
+        method, path, headers = await self._read_request(reader)
+        if path == "/health":
+            await self._send_json(writer, 200, {"status": "ok"} | self.stats())
+        elif path == "/metrics":
+            body = self._prometheus().encode()
+            await self._send(writer, 200, body, "text/plain; version=0.0.4")
+        elif path != "/render":
+            raise _HTTPError(404, "Not found")
+        elif method != "POST":
+            raise _HTTPError(405, "Use POST", {"Allow": "POST"})
+        else:
+            job, timeout = await self._read_job(reader, headers)
+            await self._render(job, timeout, writer)
+
+    async def _render(self, job, timeout, writer):
+        # Requests beyond the ones being rendered wait in line, but only so
+        # many of them. The others are turned away right away. The place in
+        # line is taken before anything is awaited, so requests that come in
+        # all at once can't slip past the check.
+        if self._admitted >= self._concurrency + self._max_queue_size:
+            raise _HTTPError(429, "Too many requests", {"Retry-After": "1"})
+        self._admitted += 1
+        try:
+            response = _ChunkedResponse(writer)
+            try:
+                await asyncio.wait_for(self._render_job(job, response), timeout)
+            except asyncio.TimeoutError:
+                if response.started:
+                    raise ConnectionError("Timed out while sending the PDF")
+                raise _HTTPError(504, "Timed out")
+            except Exception as exc:
+                if response.started:
+                    raise ConnectionError("Failed while sending the PDF") from exc
+                raise _HTTPError(500, str(exc))
+            self._responses[200] += 1
+            await response.close()
+        finally:
+            self._admitted -= 1
+
+    async def _render_job(self, job, response):
+        async with self._slots:
+            self._running += 1
+            try:
+                method, source, kwargs = _split_job(job)
+                await getattr(self._converter, method)(
+                    source, output_stream=response, **kwargs
+                )
+            finally:
+                self._running -= 1
+
+
+HTML_SUFFIXES = (".html", ".htm")
+
+
+def _cli_parser():
+    parser = argparse.ArgumentParser(
+        prog="pyhtmltopdf",
+        description="Convert HTML files, directories of HTML files or lists of "
+        "jobs to PDF",
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        help="an HTML file, a URL or a directory to convert all HTML files of",
+    )
+    parser.add_argument(
+        "output",
+        nargs="?",
+        help="the PDF file, or the directory to mirror a directory into. "
+        "Defaults to the input with a .pdf extension",
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="FILE",
+        help="read JSON lines of render_many jobs from FILE, or - for stdin",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, each with its own browser",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=4,
+        help="number of documents rendered at once by a single browser",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="also render up to date outputs"
+    )
+    parser.add_argument("--header-html", default="")
+    parser.add_argument("--footer-html", default="")
+    for option in ("render", "load", "launch", "optimize"):
+        parser.add_argument(
+            f"--{option}-options",
+            type=json.loads,
+            default={},
+            metavar="JSON",
+            help=f"{option}_options as a JSON object",
+        )
+    parser.add_argument("-q", "--quiet", action="store_true")
+    incremental = parser.add_argument_group("incremental builds")
+    incremental.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help="remember which local files every output was rendered from in FILE, "
+        "and only render outputs again when one of those changed",
+    )
+    incremental.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and render outputs again as soon as their files change",
+    )
+    incremental.add_argument(
+        "--watch-interval",
+        type=float,
+        default=1,
+        metavar="SECONDS",
+        help="how often to look for changed files",
+    )
+    server = parser.add_argument_group("server")
+    server.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="run a render server instead, see RenderServer",
+    )
+    server.add_argument("--max-queue-size", type=int, default=64)
+    server.add_argument(
+        "--timeout", type=float, default=60, help="per request timeout in seconds"
+    )
+    return parser
+
+
+def _up_to_date(job):
+    try:
+        return os.path.getmtime(job["output_path"]) >= os.path.getmtime(
+            job["file_path"]
+        )
+    except (KeyError, OSError):
+        return False
+
+
+def _cli_input_jobs(args):
+    if args.jobs is not None:
+        lines = sys.stdin if args.jobs == "-" else open(args.jobs)
+        with lines:
+            for line_number, line in enumerate(lines, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as exc:
+                        yield {"invalid": f"line {line_number}: {exc}"}
+        return
+
+    if urllib.parse.urlparse(args.input).scheme in ("http", "https"):
+        if args.output is None:
+            raise SystemExit("pyhtmltopdf: URLs need an output path")
+        yield {"url": args.input, "output_path": args.output}
+    elif os.path.isdir(args.input):
+        output = args.output or args.input
+        for directory, _, files in sorted(os.walk(args.input)):
+            for name in sorted(files):
+                if name.lower().endswith(HTML_SUFFIXES):
+                    path = os.path.join(directory, name)
+                    yield {
+                        "file_path": path,
+                        "output_path": os.path.join(
+                            output,
+                            os.path.splitext(os.path.relpath(path, args.input))[0]
+                            + ".pdf",
+                        ),
+                    }
+    else:
+        yield {
+            "file_path": args.input,
+            "output_path": args.output or os.path.splitext(args.input)[0] + ".pdf",
+        }
+
+
+def _cli_jobs(args, counts, manifest=None, first_round=True):
+    defaults = {
+        "header_html": args.header_html,
+        "footer_html": args.footer_html,
+        "render_options": args.render_options,
+        "load_options": args.load_options,
+        "optimize_options": args.optimize_options,
+    }
+    # --force only applies to the first round of --watch, and outputs that
+    # failed in one round are only tried again once their files change
+    force = args.force and first_round
+    for job in _cli_input_jobs(args):
+        if "file_path" in job and "output_path" not in job:
+            job["output_path"] = os.path.splitext(job["file_path"])[0] + ".pdf"
+        if job.get("output_path"):
+            # The PDFs go straight into the files, there is no use for them
+            # in memory
+            job.setdefault("return_bytes", False)
+        job = defaults | job
+        if manifest is not None and job.get("output_path"):
+            if not force and not manifest.stale(job, retry_failed=first_round):
+                counts["skipped"] += 1
+                continue
+            job["dependencies"] = set()
+        elif not force and _up_to_date(job):
+            counts["skipped"] += 1
+            continue
+        if job.get("output_path"):
+            os.makedirs(os.path.dirname(job["output_path"]) or ".", exist_ok=True)
+        yield job
+
+
+class _CLIConverter:
+    # Keeps one browser, or one pool of worker processes, warm across all of
+    # the rounds of --watch
+    def __init__(self, args):
+        self._args = args
+        self._pool = None
+        self._loop = None
+        self._converter = None
+
+    def __enter__(self):
+        if self._args.workers > 1:
+            self._pool = ProcessPoolConverter(
+                self._args.workers, self._args.launch_options, return_paths=True
+            )
+            self._pool.init()
+            return self
+
+        self._loop = asyncio.new_event_loop()
+        self._converter = AHTMLToPDFConverter(
+            self._args.launch_options, page_pool_size=self._args.concurrency
+        )
+        try:
+            self._loop.run_until_complete(self._converter.init())
+        except BaseException:
+            self._loop.close()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        if self._pool is not None:
+            self._pool.finish()
+            return
+        try:
+            self._loop.run_until_complete(self._converter.finish())
+        finally:
+            self._loop.close()
+
+    def render_many(self, jobs):
+        if self._pool is not None:
+            yield from self._pool.render_many(jobs)
+            return
+
+        # Drive the async generator from here, so results can be reported as
+        # they come in
+        results = self._converter.render_many(jobs, self._args.concurrency)
+        try:
+            while True:
+                try:
+                    yield self._loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            self._loop.run_until_complete(results.aclose())
+
+
+def _cli_round(args, converter, manifest, first_round):
+    counts = collections.Counter()
+    start = time.perf_counter()
+    since = time.time_ns()
+    try:
+        jobs = _cli_jobs(args, counts, manifest, first_round)
+        for result in converter.render_many(jobs):
+            if result.ok:
+                counts["rendered"] += 1
+            else:
+                counts["failed"] += 1
+                name = (
+                    result.job.get("output_path")
+                    or result.job.get("invalid")
+                    or f"Job {result.index}"
+                )
+                print(f"{name}: {result.error}", file=sys.stderr)
+            if result.job.get("dependencies") is not None:
+                manifest.record(
+                    result.job, result.job["dependencies"], since, not result.ok
+                )
+    finally:
+        if manifest is not None:
+            manifest.save()
+    seconds = time.perf_counter() - start
+
+    # Rounds of --watch that had nothing to do go by silently
+    if not args.quiet and (first_round or counts["rendered"] or counts["failed"]):
+        print(
+            f"Rendered {counts['rendered']} documents in {seconds:.1f}s "
+            f"({counts['rendered'] / seconds:.1f} documents/s), "
+            f"skipped {counts['skipped']} up to date, {counts['failed']} failed",
+            file=sys.stderr,
+        )
+    return counts
+
+
+def main(argv=None):
+    args = _cli_parser().parse_args(argv)
+    if args.serve is not None:
+        host, _, port = args.serve.rpartition(":")
+        server = RenderServer(
+            host or "127.0.0.1",
+            int(port),
+            concurrency=args.concurrency,
+            max_queue_size=args.max_queue_size,
+            timeout=args.timeout,
+            launch_options=args.launch_options,
+            page_pool_size=args.concurrency,
+            load_options=args.load_options,
+            optimize_options=args.optimize_options,
         )
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(server.serve_forever())
+        return 0
+    if (args.input is None) == (args.jobs is None):
+        _cli_parser().error("either an input or --jobs is required")
+    if args.workers < 1 or args.concurrency < 1:
+        _cli_parser().error("--workers and --concurrency must be at least 1")
+    incremental = args.manifest is not None or args.watch
+    if incremental and args.workers > 1:
+        # Only a converter in this process can tell which files a job loaded
+        _cli_parser().error("--manifest and --watch can't be used with --workers")
+    if args.watch and args.jobs == "-":
+        _cli_parser().error("--watch can't read the jobs from stdin")
+
+    manifest = RenderManifest(args.manifest) if incremental else None
+    counts = collections.Counter()
+    # --watch runs until it's interrupted
+    stop = contextlib.suppress(KeyboardInterrupt)
+    with stop if args.watch else contextlib.nullcontext():
+        with _CLIConverter(args) as converter:
+            counts = _cli_round(args, converter, manifest, first_round=True)
+            while args.watch:
+                time.sleep(args.watch_interval)
+                manifest.rescan()
+                counts = _cli_round(args, converter, manifest, first_round=False)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
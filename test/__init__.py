@@ -2,3 +2,13 @@ from .test_functional_async import *
 from .test_functional import *
 from .test_class_based_async import *
 from .test_class_based import *
+from .test_process_pool import *
+from .test_thread_safe import *
+from .test_load_balancing import *
+from .test_scheduler import *
+from .test_render_cache import *
+from .test_resource_cache import *
+from .test_render_metrics import *
+from .test_render_manifest import *
+from .test_cli import *
+from .test_server import *
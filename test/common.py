@@ -12,12 +12,20 @@ TEST_HTML = """<!DOCTYPE html>
 
 TEST_HEADER = '<p style="font-size: 12pt;">Test Header</p>'
 TEST_FOOTER = '<p style="font-size: 12pt;">Test Footer</p>'
+PAGE_NUMBER_TEST_FOOTER = (
+    '<p style="font-size: 12pt;">Page <span class="pageNumber"></span>'
+    ' of <span class="totalPages"></span></p>'
+)
 
 LAUNCH_OPTIONS = {
     "executable_path": environ.get("CHROMIUM"),
 }
 
 
+def get_pdf_reader(pdf_bytes):
+    return PdfReader(BytesIO(pdf_bytes))
+
+
 def get_pdf_text(pdf_bytes):
     io = BytesIO(pdf_bytes)
     reader = PdfReader(io)
@@ -30,3 +38,87 @@ def check_test_pdf(testcls, pdf):
     testcls.assertIn("Some example text", all_text)
     testcls.assertIn("Test Header", all_text)
     testcls.assertIn("Test Footer", all_text)
+
+
+BASE_URL_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <body>
+        <h1>Test HTML</h1>
+        <p id="location"></p>
+        <script>
+            document.getElementById("location").textContent = document.baseURI;
+        </script>
+    </body>
+</html>"""
+
+USER_AGENT_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <body>
+        <h1>Test HTML</h1>
+        <p id="user-agent"></p>
+        <script>
+            document.getElementById("user-agent").textContent = navigator.userAgent;
+        </script>
+    </body>
+</html>"""
+
+RESOURCE_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <head>
+        <link rel="stylesheet" href="style.css">
+    </head>
+    <body>
+        <h1>Test HTML</h1>
+    </body>
+</html>"""
+
+RESOURCE_TEST_CSS = b'h1::after { content: " Styled"; }'
+
+READY_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <body>
+        <h1>Test HTML</h1>
+        <script>
+            setTimeout(() => {
+                document.body.append("Rendered late");
+                window.documentReady = true;
+            }, 200);
+        </script>
+    </body>
+</html>"""
+
+TEMPLATE_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <body>
+        <h1>Test HTML</h1>
+        <p id="text"></p>
+        <script>
+            window.render = (data) => {
+                document.getElementById("text").textContent = data.text;
+            };
+        </script>
+    </body>
+</html>"""
+
+MULTI_PAGE_TEST_HTML = (
+    "<!DOCTYPE html><html><body>"
+    + "".join(f'<h1 style="break-after: page;">Page {i}</h1>' for i in range(1, 6))
+    + "</body></html>"
+)
+
+OVERFLOW_TEST_HTML = """<!DOCTYPE html>
+<html>
+    <body>
+        <h1>Test HTML</h1>
+        <div id="wide" style="width: 1000px;">Some example text</div>
+    </body>
+</html>"""
+
+
+def check_chunked_pdf(testcls, pdf):
+    reader = get_pdf_reader(pdf)
+    testcls.assertEqual(len(reader.pages), 5)
+    for i, page in enumerate(reader.pages, 1):
+        text = page.extract_text()
+        testcls.assertIn(f"Page {i}", text)
+        testcls.assertIn(f"Page {i} of 5", text)
@@ -1,5 +1,8 @@
+import asyncio
+import os
 import unittest
 import tempfile
+from os.path import realpath
 from .common import *
 from pyhtmltopdf import *
 
@@ -128,3 +131,400 @@ class TestClassBasedAsync(unittest.IsolatedAsyncioTestCase):
             )
             second_pdf_text = get_pdf_text(second_pdf)
             self.assertIn("Second PDF", second_pdf_text)
+
+    async def test_page_pool(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS, page_pool_size=2) as converter:
+            for i in range(3):
+                pdf = await converter.from_string(
+                    TEST_HTML,
+                    header_html=TEST_HEADER,
+                    footer_html=TEST_FOOTER,
+                )
+                check_test_pdf(self, pdf)
+
+            stats = converter.page_pool_stats()
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["hits"], 2)
+            self.assertEqual(stats["size"], 1)
+
+    async def test_page_pool_concurrent_release(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS, page_pool_size=2) as converter:
+            pdfs = await asyncio.gather(
+                *(converter.from_string(TEST_HTML) for i in range(6))
+            )
+            for pdf in pdfs:
+                self.assertIn("Some example text", get_pdf_text(pdf))
+
+            self.assertEqual(converter.page_pool_stats()["size"], 2)
+
+    async def test_render_many(self):
+        jobs = [
+            {
+                "string": TEST_HTML,
+                "header_html": TEST_HEADER,
+                "footer_html": TEST_FOOTER,
+            }
+            for i in range(5)
+        ]
+        jobs.insert(2, {"file_path": "/nonexistent/file.html"})
+
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            results = [
+                result
+                async for result in converter.render_many(
+                    jobs, concurrency=2, ordered=True
+                )
+            ]
+
+        self.assertEqual([result.index for result in results], list(range(6)))
+        self.assertFalse(results[2].ok)
+        self.assertIsNotNone(results[2].error)
+        for result in results[:2] + results[3:]:
+            self.assertTrue(result.ok)
+            check_test_pdf(self, result.pdf)
+
+    async def test_from_string_base_url(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            pdf = await converter.from_string(
+                BASE_URL_TEST_HTML,
+                base_url="https://example.com/invoices/",
+            )
+            all_text = get_pdf_text(pdf)
+            self.assertIn("Test HTML", all_text)
+            self.assertIn("https://example.com/invoices/", all_text)
+
+    async def test_from_string_file_base_url(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "style.css"), "wb") as f:
+                f.write(RESOURCE_TEST_CSS)
+            base_url = "file://" + realpath(directory) + "/index.html"
+            async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+                pdf = await converter.from_string(RESOURCE_TEST_HTML, base_url=base_url)
+            self.assertIn("Styled", get_pdf_text(pdf))
+
+    async def test_from_string_assets(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            pdf = await converter.from_string(
+                RESOURCE_TEST_HTML, assets={"style.css": RESOURCE_TEST_CSS}
+            )
+            self.assertIn("Styled", get_pdf_text(pdf))
+
+            requested = []
+
+            def load_asset(path):
+                requested.append(path)
+                return RESOURCE_TEST_CSS
+
+            pdf = await converter.from_string(
+                RESOURCE_TEST_HTML,
+                base_url="https://example.com/invoices/",
+                assets=load_asset,
+            )
+            self.assertIn("Styled", get_pdf_text(pdf))
+            self.assertEqual(requested, ["style.css"])
+
+    async def test_contexts(self):
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS,
+            context_options={
+                "tenant-a": {"user_agent": "Tenant A"},
+                "tenant-b": {"user_agent": "Tenant B"},
+            },
+            max_contexts=1,
+        ) as converter:
+            for context, user_agent in (
+                ("tenant-a", "Tenant A"),
+                ("tenant-a", "Tenant A"),
+                ("tenant-b", "Tenant B"),
+            ):
+                pdf = await converter.from_string(USER_AGENT_TEST_HTML, context=context)
+                self.assertIn(user_agent, get_pdf_text(pdf))
+
+            stats = converter.context_pool_stats()
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["misses"], 2)
+            self.assertEqual(stats["evictions"], 1)
+            self.assertEqual(stats["size"], 1)
+
+    async def test_cache(self):
+        cache = RenderCache()
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS, cache=cache) as converter:
+            first_pdf = await converter.from_string(
+                TEST_HTML, header_html=TEST_HEADER, footer_html=TEST_FOOTER
+            )
+            second_pdf = await converter.from_string(
+                TEST_HTML, header_html=TEST_HEADER, footer_html=TEST_FOOTER
+            )
+            check_test_pdf(self, second_pdf)
+            self.assertEqual(first_pdf, second_pdf)
+
+            await converter.from_url("https://example.com")
+            await converter.from_url("https://example.com")
+            stats = cache.stats()
+            self.assertEqual(stats["memory_hits"], 1)
+            self.assertEqual(stats["misses"], 1)
+
+    async def test_output_stream(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            stream = BytesIO()
+            result = await converter.from_string(
+                TEST_HTML,
+                header_html=TEST_HEADER,
+                footer_html=TEST_FOOTER,
+                render_options={
+                    "margin": {
+                        "top": "2cm",
+                        "bottom": "2cm",
+                    },
+                },
+                output_stream=stream,
+            )
+            self.assertIsNone(result)
+            check_test_pdf(self, stream.getvalue())
+
+    async def test_no_return_bytes_failure(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = directory + "/output.pdf"
+            async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+                with self.assertRaises(ValueError):
+                    await converter.from_string(
+                        TEST_HTML,
+                        output_path,
+                        render_options={"format": "a7"},
+                        return_bytes=False,
+                    )
+            # Nothing is left behind, not even an empty file
+            self.assertEqual(os.listdir(directory), [])
+
+    async def test_output_stream_page_size(self):
+        # Streamed PDFs get the same paper size as the ones page.pdf() makes,
+        # where width and height don't count next to a format
+        render_options = {"width": "4in", "height": "4in"}
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            pdf = await converter.from_string(TEST_HTML, render_options=render_options)
+            stream = BytesIO()
+            await converter.from_string(
+                TEST_HTML, render_options=render_options, output_stream=stream
+            )
+        page = get_pdf_reader(pdf).pages[0]
+        streamed_page = get_pdf_reader(stream.getvalue()).pages[0]
+        self.assertEqual(
+            (round(page.mediabox.width), round(page.mediabox.height)),
+            (round(streamed_page.mediabox.width), round(streamed_page.mediabox.height)),
+        )
+
+    async def test_resource_cache(self):
+        resource_cache = ResourceCache()
+        resource_cache.preload("https://example.com/style.css", body=RESOURCE_TEST_CSS)
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS, resource_cache=resource_cache
+        ) as converter:
+            for i in range(2):
+                pdf = await converter.from_string(
+                    RESOURCE_TEST_HTML, base_url="https://example.com/"
+                )
+                self.assertIn("Styled", get_pdf_text(pdf))
+        self.assertEqual(resource_cache.stats()["hits"], 2)
+
+    async def test_load_options(self):
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS,
+            load_options={"wait_until": "domcontentloaded", "timeout": 10000},
+        ) as converter:
+            pdf = await converter.from_string(
+                READY_TEST_HTML,
+                load_options={"wait_for_function": "window.documentReady === true"},
+            )
+            self.assertIn("Rendered late", get_pdf_text(pdf))
+
+            with self.assertRaises(Exception):
+                await converter.from_string(
+                    READY_TEST_HTML,
+                    load_options={
+                        "wait_for_selector": "#never-there",
+                        "timeout": 500,
+                    },
+                )
+
+    async def test_recycle(self):
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS, page_pool_size=1, recycle_options={"max_renders": 2}
+        ) as converter:
+            for i in range(5):
+                pdf = await converter.from_string(TEST_HTML)
+                check_test_pdf(self, pdf)
+
+            stats = converter.browser_stats()
+            self.assertEqual(stats["launches"], 3)
+            self.assertEqual(stats["recycles"], 2)
+            self.assertEqual(stats["renders"], 1)
+
+    async def test_crash_recovery(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            await converter._browser.close()
+            pdf = await converter.from_string(TEST_HTML)
+            check_test_pdf(self, pdf)
+            self.assertEqual(converter.browser_stats()["launches"], 2)
+
+    async def test_hooks(self):
+        events = []
+        metrics = RenderMetrics()
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS, hooks=[metrics, lambda *event: events.append(event)]
+        ) as converter:
+            pdf = await converter.from_string(TEST_HTML)
+            check_test_pdf(self, pdf)
+
+        self.assertEqual(
+            [event for event, value in events],
+            [
+                "launch",
+                "new_page",
+                "goto",
+                "wait",
+                "pdf_size",
+                "pdf",
+                "close",
+                "render",
+            ],
+        )
+        self.assertIn(("pdf_size", len(pdf)), events)
+        self.assertEqual(metrics.counters()["launch"], 1)
+        self.assertEqual(metrics.histograms()["render"]["count"], 1)
+
+    async def test_optimize(self):
+        events = []
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS,
+            optimize_options={"deduplicate": True},
+            hooks=[lambda *event: events.append(event)],
+        ) as converter:
+            optimized_pdf = await converter.from_string(MULTI_PAGE_TEST_HTML)
+            pdf = await converter.from_string(MULTI_PAGE_TEST_HTML, optimize_options={})
+
+        self.assertLessEqual(len(optimized_pdf), len(pdf))
+        self.assertEqual(
+            len(get_pdf_reader(optimized_pdf).pages), len(get_pdf_reader(pdf).pages)
+        )
+        self.assertEqual(get_pdf_text(optimized_pdf), get_pdf_text(pdf))
+        savings = [value for event, value in events if event == "optimize_savings"]
+        self.assertEqual(len(savings), 1)
+        self.assertGreaterEqual(savings[0], 0)
+
+    async def test_preflight(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            report = await converter.preflight({"string": MULTI_PAGE_TEST_HTML})
+            pdf = await converter.from_string(MULTI_PAGE_TEST_HTML)
+            self.assertEqual(report["page_count"], len(get_pdf_reader(pdf).pages))
+            self.assertEqual(report["overflowing"], [])
+
+            reports = []
+
+            def turn_wide_pages(report):
+                reports.append(report)
+                if report["overflowing"]:
+                    return {"landscape": True}
+
+            pdf = await converter.from_string(
+                OVERFLOW_TEST_HTML, preflight=turn_wide_pages
+            )
+            self.assertEqual(reports[0]["overflowing"][0]["element"], "div#wide")
+            page = get_pdf_reader(pdf).pages[0]
+            self.assertGreater(page.mediabox.width, page.mediabox.height)
+            self.assertIn("Some example text", get_pdf_text(pdf))
+
+            pdf = await converter.from_string(TEST_HTML, preflight=lambda report: False)
+            self.assertIsNone(pdf)
+
+    async def test_dependencies(self):
+        with tempfile.TemporaryDirectory() as directory:
+            html_path = os.path.join(directory, "index.html")
+            with open(html_path, "w") as f:
+                f.write(RESOURCE_TEST_HTML)
+            with open(os.path.join(directory, "style.css"), "wb") as f:
+                f.write(RESOURCE_TEST_CSS)
+
+            dependencies = set()
+            async with AHTMLToPDFConverter(
+                LAUNCH_OPTIONS, cache=RenderCache()
+            ) as converter:
+                for i in range(2):
+                    pdf = await converter.from_file(
+                        html_path, dependencies=dependencies
+                    )
+                    self.assertIn("Styled", get_pdf_text(pdf))
+            self.assertEqual(
+                dependencies,
+                {realpath(html_path), realpath(os.path.join(directory, "style.css"))},
+            )
+
+    async def test_from_template(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            for text in ("Some example text", "Other example text"):
+                pdf = await converter.from_template(
+                    TEMPLATE_TEST_HTML,
+                    {"text": text},
+                    header_html=TEST_HEADER,
+                    footer_html=TEST_FOOTER,
+                )
+                all_text = get_pdf_text(pdf)
+                self.assertIn("Test HTML", all_text)
+                self.assertIn(text, all_text)
+
+            stats = converter.page_pool_stats()
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["template_pages"], 1)
+
+    async def test_template_eviction(self):
+        async with AHTMLToPDFConverter(
+            LAUNCH_OPTIONS, max_template_pages=1
+        ) as converter:
+            for text in ("Some example text", "Other example text"):
+                template = TEMPLATE_TEST_HTML.replace("Test HTML", text)
+                pdf = await converter.from_template(template, {"text": text})
+                self.assertIn(text, get_pdf_text(pdf))
+
+            stats = converter.page_pool_stats()
+            self.assertEqual(stats["template_pages"], 1)
+            self.assertEqual(stats["template_evictions"], 1)
+
+    async def test_from_parts(self):
+        parts = (
+            html
+            for html in (
+                TEST_HTML,
+                {
+                    "string": TEST_HTML.replace("Test HTML", "Second part"),
+                    "title": "Second",
+                },
+            )
+        )
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            pdf = await converter.from_parts(
+                parts,
+                footer_html=PAGE_NUMBER_TEST_FOOTER,
+                render_options={"margin": {"bottom": "2cm"}},
+                bookmarks=True,
+            )
+
+        reader = get_pdf_reader(pdf)
+        self.assertEqual(len(reader.pages), 2)
+        self.assertIn("Test HTML", reader.pages[0].extract_text())
+        self.assertIn("Page 1 of 2", reader.pages[0].extract_text())
+        self.assertIn("Second part", reader.pages[1].extract_text())
+        self.assertIn("Page 2 of 2", reader.pages[1].extract_text())
+        self.assertIn("Second", [item.title for item in reader.outline])
+
+    async def test_render_chunked(self):
+        async with AHTMLToPDFConverter(LAUNCH_OPTIONS) as converter:
+            pdf = await converter.render_chunked(
+                {
+                    "string": MULTI_PAGE_TEST_HTML,
+                    "footer_html": PAGE_NUMBER_TEST_FOOTER,
+                    "render_options": {"margin": {"bottom": "2cm"}},
+                },
+                chunk_pages=2,
+                concurrency=2,
+            )
+        check_chunked_pdf(self, pdf)
@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import sys
+import unittest
+import tempfile
+from os.path import realpath
+from .common import *
+from pyhtmltopdf import *
+
+CLI_LAUNCH_OPTIONS = ["--launch-options", json.dumps(LAUNCH_OPTIONS)]
+
+
+class TestCLI(unittest.TestCase):
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "in", "sub"))
+            for name in ("a.html", os.path.join("sub", "b.htm")):
+                with open(os.path.join(directory, "in", name), "w") as f:
+                    f.write(TEST_HTML)
+            args = [
+                os.path.join(directory, "in"),
+                os.path.join(directory, "out"),
+                *CLI_LAUNCH_OPTIONS,
+                "--quiet",
+            ]
+
+            self.assertEqual(main(args), 0)
+            for name in ("a.pdf", os.path.join("sub", "b.pdf")):
+                with open(os.path.join(directory, "out", name), "rb") as f:
+                    check_test_pdf(self, f.read())
+
+            # Nothing changed, so nothing gets rendered again
+            mtime = os.path.getmtime(os.path.join(directory, "out", "a.pdf"))
+            self.assertEqual(main(args), 0)
+            self.assertEqual(
+                os.path.getmtime(os.path.join(directory, "out", "a.pdf")), mtime
+            )
+
+    def test_failed_job_rendered_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "a.html")
+            output_path = os.path.join(directory, "a.pdf")
+            with open(input_path, "w") as f:
+                f.write(TEST_HTML)
+            args = [input_path, *CLI_LAUNCH_OPTIONS, "--quiet"]
+
+            bad_options = ["--render-options", json.dumps({"format": "a7"})]
+            self.assertEqual(main(args + bad_options), 1)
+            self.assertFalse(os.path.exists(output_path))
+
+            # The failed job left nothing behind that looks up to date
+            self.assertEqual(main(args), 0)
+            with open(output_path, "rb") as f:
+                self.assertIn("Some example text", get_pdf_text(f.read()))
+
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "in"))
+            for name, html in (("a.html", RESOURCE_TEST_HTML), ("b.html", TEST_HTML)):
+                with open(os.path.join(directory, "in", name), "w") as f:
+                    f.write(html)
+            style_path = os.path.join(directory, "in", "style.css")
+            with open(style_path, "wb") as f:
+                f.write(RESOURCE_TEST_CSS)
+            args = [
+                os.path.join(directory, "in"),
+                os.path.join(directory, "out"),
+                "--manifest",
+                os.path.join(directory, "manifest.json"),
+                *CLI_LAUNCH_OPTIONS,
+                "--quiet",
+            ]
+
+            self.assertEqual(main(args), 0)
+            manifest = RenderManifest(os.path.join(directory, "manifest.json"))
+            self.assertEqual(
+                manifest.dependents(realpath(style_path)),
+                [os.path.join(directory, "out", "a.pdf")],
+            )
+            mtimes = {
+                name: os.path.getmtime(os.path.join(directory, "out", name))
+                for name in ("a.pdf", "b.pdf")
+            }
+
+            # Only the PDF that uses the stylesheet gets rendered again
+            later = os.path.getmtime(style_path) + 10
+            os.utime(style_path, (later, later))
+            self.assertEqual(main(args), 0)
+            self.assertNotEqual(
+                os.path.getmtime(os.path.join(directory, "out", "a.pdf")),
+                mtimes["a.pdf"],
+            )
+            self.assertEqual(
+                os.path.getmtime(os.path.join(directory, "out", "b.pdf")),
+                mtimes["b.pdf"],
+            )
+
+    def test_jobs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "out.pdf")
+            jobs = json.dumps({"string": TEST_HTML, "output_path": output_path})
+            stdin = sys.stdin
+            sys.stdin = io.StringIO(jobs + "\n{}\n")
+            try:
+                exit_code = main(["--jobs", "-", "-w", "2", *CLI_LAUNCH_OPTIONS])
+            finally:
+                sys.stdin = stdin
+
+            self.assertEqual(exit_code, 1)
+            with open(output_path, "rb") as f:
+                check_test_pdf(self, f.read())
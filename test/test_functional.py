@@ -1,5 +1,7 @@
 import unittest
 import tempfile
+import threading
+import time
 from .common import *
 from pyhtmltopdf import *
 
@@ -56,3 +58,38 @@ class TestFunctional(unittest.TestCase):
             launch_options=LAUNCH_OPTIONS,
         )
         check_test_pdf(self, pdf)
+
+    def test_shared_browser(self):
+        enable_shared_browser(idle_timeout=1)
+        try:
+            for i in range(2):
+                pdf = from_string(
+                    TEST_HTML,
+                    header_html=TEST_HEADER,
+                    footer_html=TEST_FOOTER,
+                    launch_options=LAUNCH_OPTIONS,
+                )
+                check_test_pdf(self, pdf)
+        finally:
+            disable_shared_browser()
+
+    def test_shared_browser_disable_while_rendering(self):
+        enable_shared_browser(idle_timeout=1)
+        pdfs = []
+        thread = threading.Thread(
+            target=lambda: pdfs.append(
+                from_string(
+                    TEST_HTML,
+                    header_html=TEST_HEADER,
+                    footer_html=TEST_FOOTER,
+                    launch_options=LAUNCH_OPTIONS,
+                )
+            )
+        )
+        thread.start()
+        time.sleep(0.5)
+        disable_shared_browser()
+        thread.join(timeout=30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(pdfs), 1)
+        check_test_pdf(self, pdfs[0])
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 import tempfile
 from .common import *
@@ -56,3 +57,22 @@ class TestFunctionalAsync(unittest.IsolatedAsyncioTestCase):
             launch_options=LAUNCH_OPTIONS,
         )
         check_test_pdf(self, pdf)
+
+    async def test_shared_browser(self):
+        enable_shared_browser(idle_timeout=1)
+        try:
+            pdfs = await asyncio.gather(
+                *(
+                    afrom_string(
+                        TEST_HTML,
+                        header_html=TEST_HEADER,
+                        footer_html=TEST_FOOTER,
+                        launch_options=LAUNCH_OPTIONS,
+                    )
+                    for i in range(3)
+                )
+            )
+            for pdf in pdfs:
+                check_test_pdf(self, pdf)
+        finally:
+            disable_shared_browser()
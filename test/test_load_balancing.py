@@ -0,0 +1,73 @@
+import socket
+import unittest
+from playwright.async_api import async_playwright
+from .common import *
+from pyhtmltopdf import *
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestLoadBalancing(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # A stand-in for a remote browser, reachable over CDP on localhost
+        port = free_port()
+        self.playwright = await async_playwright().start()
+        self.remote_browser = await self.playwright.chromium.launch(
+            **(
+                DEFAULT_LAUNCH_OPTIONS
+                | LAUNCH_OPTIONS
+                | {"args": ["--no-sandbox", f"--remote-debugging-port={port}"]}
+            )
+        )
+        self.endpoints = [
+            {"launch": LAUNCH_OPTIONS},
+            {"connect_over_cdp": f"http://127.0.0.1:{port}"},
+            {"connect_over_cdp": f"http://127.0.0.1:{free_port()}"},
+        ]
+
+    async def asyncTearDown(self):
+        await self.remote_browser.close()
+        await self.playwright.stop()
+
+    async def test_render_many(self):
+        jobs = [
+            {"string": f"<!DOCTYPE html><html><body><h1>PDF {i}</h1></body></html>"}
+            for i in range(8)
+        ]
+        async with ALoadBalancedConverter(self.endpoints) as converter:
+            results = [
+                result async for result in converter.render_many(jobs, ordered=True)
+            ]
+            stats = converter.endpoint_stats()
+
+        for i, result in enumerate(results):
+            self.assertTrue(result.ok)
+            self.assertIn(f"PDF {i}", get_pdf_text(result.pdf))
+        self.assertEqual(
+            [endpoint["healthy"] for endpoint in stats], [True, True, False]
+        )
+        self.assertGreater(stats[0]["renders"], 0)
+        self.assertGreater(stats[1]["renders"], 0)
+
+    async def test_failover(self):
+        async with ALoadBalancedConverter(
+            self.endpoints, health_check_interval=0.5
+        ) as converter:
+            await self.remote_browser.close()
+            for i in range(4):
+                pdf = await converter.from_string(TEST_HTML)
+                self.assertIn("Test HTML", get_pdf_text(pdf))
+
+            stats = converter.endpoint_stats()
+            self.assertEqual(
+                [endpoint["healthy"] for endpoint in stats], [True, False, False]
+            )
+            self.assertEqual(stats[1]["ejections"], 1)
+
+    async def test_no_endpoints(self):
+        with self.assertRaises(RuntimeError):
+            await ALoadBalancedConverter(self.endpoints[2:]).init()
@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+from .common import *
+from pyhtmltopdf import *
+
+
+class TestProcessPool(unittest.TestCase):
+    def test_from_string(self):
+        with ProcessPoolConverter(2, LAUNCH_OPTIONS) as converter:
+            pdf = converter.from_string(
+                TEST_HTML,
+                header_html=TEST_HEADER,
+                footer_html=TEST_FOOTER,
+                render_options={
+                    "margin": {
+                        "top": "2cm",
+                        "bottom": "2cm",
+                    },
+                },
+            )
+            check_test_pdf(self, pdf)
+
+    def test_render_many(self):
+        jobs = [
+            {
+                "string": f"<!DOCTYPE html><html><body><h1>PDF {i}</h1></body></html>",
+            }
+            for i in range(6)
+        ]
+        jobs.append({"file_path": "/nonexistent/file.html"})
+
+        with ProcessPoolConverter(2, LAUNCH_OPTIONS) as converter:
+            results = list(converter.render_many(jobs, ordered=True))
+
+        self.assertEqual([result.index for result in results], list(range(7)))
+        for i, result in enumerate(results[:-1]):
+            self.assertTrue(result.ok)
+            self.assertIn(f"PDF {i}", get_pdf_text(result.pdf))
+        self.assertFalse(results[-1].ok)
+
+    def test_return_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = directory + "/output.pdf"
+            with ProcessPoolConverter(
+                1, LAUNCH_OPTIONS, return_paths=True
+            ) as converter:
+                result = converter.from_string(TEST_HTML, output_path)
+            self.assertEqual(result, output_path)
+            with open(output_path, "rb") as f:
+                self.assertIn("Test HTML", get_pdf_text(f.read()))
+
+    def test_render_chunked(self):
+        with ProcessPoolConverter(2, LAUNCH_OPTIONS) as converter:
+            pdf = converter.render_chunked(
+                {
+                    "string": MULTI_PAGE_TEST_HTML,
+                    "footer_html": PAGE_NUMBER_TEST_FOOTER,
+                    "render_options": {"margin": {"bottom": "2cm"}},
+                },
+                chunk_pages=2,
+            )
+        check_chunked_pdf(self, pdf)
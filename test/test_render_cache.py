@@ -0,0 +1,58 @@
+import os
+import pickle
+import unittest
+import tempfile
+from pyhtmltopdf import *
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_memory_lru(self):
+        cache = RenderCache(max_memory_size=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        self.assertEqual(cache.get("a"), b"aaaa")
+        cache.put("c", b"cccc")
+
+        self.assertEqual(cache.get("a"), b"aaaa")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), b"cccc")
+
+        stats = cache.stats()
+        self.assertEqual(stats["memory_hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["memory_evictions"], 1)
+        self.assertEqual(stats["memory_size"], 8)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(max_memory_size=0, directory=directory)
+            cache.put("a", b"%PDF-a")
+            self.assertEqual(cache.get("a"), b"%PDF-a")
+
+            reopened = RenderCache(directory=directory)
+            self.assertEqual(reopened.get("a"), b"%PDF-a")
+            self.assertEqual(reopened.get("a"), b"%PDF-a")
+            stats = reopened.stats()
+            self.assertEqual(stats["disk_hits"], 1)
+            self.assertEqual(stats["memory_hits"], 1)
+            self.assertEqual(stats["disk_entries"], 1)
+
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(directory=directory, max_disk_size=10)
+            cache.put("a", b"aaaa")
+            cache.put("b", b"bbbb")
+            cache.put("c", b"cccc")
+
+            self.assertEqual(sorted(os.listdir(directory)), ["b.pdf", "c.pdf"])
+            stats = cache.stats()
+            self.assertEqual(stats["disk_evictions"], 1)
+            self.assertEqual(stats["disk_size"], 8)
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(directory=directory)
+            cache.put("a", b"%PDF-a")
+            copy = pickle.loads(pickle.dumps(cache))
+            self.assertEqual(copy.get("a"), b"%PDF-a")
+            self.assertEqual(copy.stats()["disk_hits"], 1)
@@ -0,0 +1,93 @@
+import os
+import time
+import unittest
+import tempfile
+from pyhtmltopdf import *
+
+
+def touch(path):
+    # Makes sure the modification time changes, however coarse it is
+    with open(path, "w") as f:
+        f.write(path)
+    later = time.time_ns() + 10**9
+    os.utime(path, ns=(later, later))
+
+
+class TestRenderManifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.paths = {
+            name: os.path.join(self.directory.name, name)
+            for name in ("a.html", "b.html", "style.css", "a.pdf", "b.pdf")
+        }
+        for path in self.paths.values():
+            touch(path)
+        self.jobs = {
+            name: {
+                "file_path": self.paths[f"{name}.html"],
+                "output_path": self.paths[f"{name}.pdf"],
+            }
+            for name in "ab"
+        }
+
+    def test_stale(self):
+        manifest = RenderManifest()
+        self.assertTrue(manifest.stale(self.jobs["a"]))
+        manifest.record(self.jobs["a"], {self.paths["a.html"], self.paths["style.css"]})
+        manifest.record(self.jobs["b"], {self.paths["b.html"]})
+        self.assertFalse(manifest.stale(self.jobs["a"]))
+        self.assertFalse(manifest.stale(self.jobs["b"]))
+        self.assertEqual(
+            manifest.dependents(self.paths["style.css"]), [self.paths["a.pdf"]]
+        )
+
+        # Nothing is looked at again until the next rescan
+        touch(self.paths["style.css"])
+        self.assertFalse(manifest.stale(self.jobs["a"]))
+        manifest.rescan()
+        self.assertTrue(manifest.stale(self.jobs["a"]))
+        self.assertFalse(manifest.stale(self.jobs["b"]))
+
+        # Different options make for a different output
+        self.assertTrue(
+            manifest.stale(self.jobs["b"] | {"render_options": {"landscape": True}})
+        )
+
+        os.remove(self.paths["b.pdf"])
+        self.assertTrue(manifest.stale(self.jobs["b"]))
+        manifest.forget(self.paths["b.pdf"])
+        self.assertEqual(manifest.dependents(self.paths["b.html"]), [])
+
+    def test_changed_while_rendering(self):
+        manifest = RenderManifest()
+        since = time.time_ns()
+        touch(self.paths["style.css"])
+        manifest.record(
+            self.jobs["a"], {self.paths["a.html"], self.paths["style.css"]}, since
+        )
+        self.assertTrue(manifest.stale(self.jobs["a"]))
+
+    def test_failed(self):
+        manifest = RenderManifest()
+        os.remove(self.paths["a.pdf"])
+        manifest.record(self.jobs["a"], {self.paths["a.html"]}, failed=True)
+        self.assertTrue(manifest.stale(self.jobs["a"]))
+        self.assertFalse(manifest.stale(self.jobs["a"], retry_failed=False))
+
+        touch(self.paths["a.html"])
+        manifest.rescan()
+        self.assertTrue(manifest.stale(self.jobs["a"], retry_failed=False))
+
+    def test_save(self):
+        path = os.path.join(self.directory.name, "manifest.json")
+        manifest = RenderManifest(path)
+        manifest.record(self.jobs["a"], {self.paths["a.html"]})
+        manifest.save()
+
+        reopened = RenderManifest(path)
+        self.assertFalse(reopened.stale(self.jobs["a"]))
+        self.assertTrue(reopened.stale(self.jobs["b"]))
+        self.assertEqual(
+            reopened.dependents(self.paths["a.html"]), [self.paths["a.pdf"]]
+        )
@@ -0,0 +1,40 @@
+import pickle
+import unittest
+from pyhtmltopdf import *
+
+
+class TestRenderMetrics(unittest.TestCase):
+    def test_histograms(self):
+        metrics = RenderMetrics(time_buckets=(0.1, 1))
+        for duration in (0.05, 0.5, 0.7, 5):
+            metrics("goto", duration)
+        metrics("cache_hit", 1)
+
+        self.assertEqual(metrics.counters(), {"goto": 4, "cache_hit": 1})
+        histogram = metrics.histograms()["goto"]
+        self.assertEqual(histogram["buckets"], [(0.1, 1), (1, 3), (float("inf"), 4)])
+        self.assertEqual(histogram["count"], 4)
+        self.assertAlmostEqual(histogram["sum"], 6.25)
+        self.assertNotIn("cache_hit", metrics.histograms())
+
+    def test_prometheus(self):
+        metrics = RenderMetrics(time_buckets=(1,), size_buckets=(1024,))
+        metrics("pdf", 0.5)
+        metrics("pdf_size", 2048)
+        metrics("optimize_savings", 512)
+
+        text = metrics.prometheus()
+        self.assertIn('pyhtmltopdf_events_total{event="pdf"} 1', text)
+        self.assertIn('pyhtmltopdf_stage_seconds_bucket{stage="pdf",le="1"} 1', text)
+        self.assertIn('pyhtmltopdf_stage_seconds_count{stage="pdf"} 1', text)
+        self.assertIn('pyhtmltopdf_pdf_size_bytes_bucket{le="1024"} 0', text)
+        self.assertIn('pyhtmltopdf_pdf_size_bytes_bucket{le="+Inf"} 1', text)
+        self.assertIn('pyhtmltopdf_optimize_savings_bytes_bucket{le="1024"} 1', text)
+
+    def test_reset_and_pickle(self):
+        metrics = RenderMetrics()
+        metrics("render", 1)
+        self.assertEqual(pickle.loads(pickle.dumps(metrics)).counters(), {})
+        metrics.reset()
+        self.assertEqual(metrics.counters(), {})
+        self.assertEqual(metrics.histograms(), {})
@@ -0,0 +1,52 @@
+import os
+import re
+import pickle
+import unittest
+import tempfile
+from pyhtmltopdf import *
+
+
+class TestResourceCache(unittest.TestCase):
+    def test_matches(self):
+        cache = ResourceCache()
+        self.assertTrue(cache.matches("https://example.com/style.css"))
+        self.assertTrue(cache.matches("https://example.com/font.woff2?v=3"))
+        self.assertFalse(cache.matches("https://example.com/invoice"))
+
+        cache = ResourceCache(url_patterns=[re.compile(r"^https://cdn\.")])
+        self.assertTrue(cache.matches("https://cdn.example.com/anything"))
+        self.assertFalse(cache.matches("https://example.com/style.css"))
+
+    def test_lru(self):
+        cache = ResourceCache(max_size=10)
+        cache.put("a", 200, {}, b"aaaa")
+        cache.put("b", 200, {}, b"bbbb")
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", 200, {"Content-Encoding": "gzip"}, b"cccc")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), (200, {}, b"cccc"))
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 8)
+
+    def test_preload_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, "css"))
+            with open(os.path.join(directory, "css", "main.css"), "wb") as f:
+                f.write(b"body {}")
+
+            cache = ResourceCache()
+            cache.preload_directory(directory, "https://example.com/assets/")
+            status, headers, body = cache.get("https://example.com/assets/css/main.css")
+            self.assertEqual(status, 200)
+            self.assertEqual(headers["content-type"], "text/css")
+            self.assertEqual(body, b"body {}")
+
+    def test_pickle(self):
+        cache = ResourceCache()
+        cache.preload("https://example.com/logo.svg", body=b"<svg/>")
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy.get("https://example.com/logo.svg")[2], b"<svg/>")
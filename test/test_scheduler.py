@@ -0,0 +1,88 @@
+import asyncio
+import time
+import unittest
+from pyhtmltopdf import *
+
+
+class RecordingConverter:
+    # Renders nothing, only remembers in which order the jobs started
+    def __init__(self):
+        self.started = []
+
+    async def from_string(self, string, *args, **kwargs):
+        self.started.append(string)
+        await asyncio.sleep(0.05)
+        return string.encode()
+
+
+class TestScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.converter = RecordingConverter()
+        self.scheduler = ARenderScheduler(
+            self.converter,
+            concurrency=1,
+            priorities=("interactive", "bulk"),
+            default_priority="bulk",
+        )
+
+    async def test_priorities(self):
+        jobs = [
+            asyncio.ensure_future(
+                self.scheduler.from_string(f"{caller}{i}", caller=caller)
+            )
+            for caller in ("a", "b")
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        jobs.append(
+            asyncio.ensure_future(
+                self.scheduler.from_string("interactive", priority="interactive")
+            )
+        )
+        await asyncio.gather(*jobs)
+
+        # The interactive job goes right after the one that was already
+        # running, then the callers take turns
+        self.assertEqual(
+            self.converter.started,
+            ["a0", "interactive", "a1", "b0", "a2", "b1", "b2"],
+        )
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["running"], 0)
+        self.assertEqual(stats["priorities"]["bulk"]["started"], 6)
+        self.assertEqual(stats["priorities"]["interactive"]["started"], 1)
+        self.assertEqual(stats["priorities"]["bulk"]["wait_time"]["count"], 6)
+
+    async def test_deadlines(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.scheduler.from_string("expired", deadline=time.monotonic())
+
+        running = asyncio.ensure_future(self.scheduler.from_string("running"))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.scheduler.from_string(
+                "too late", deadline=time.monotonic() + 0.01
+            )
+        await running
+
+        self.assertEqual(self.converter.started, ["running"])
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["priorities"]["bulk"]["expired"], 2)
+        self.assertEqual(stats["priorities"]["bulk"]["queued"], 0)
+
+    async def test_cancel(self):
+        running = asyncio.ensure_future(self.scheduler.from_string("running"))
+        waiting = asyncio.ensure_future(self.scheduler.from_string("cancelled"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await running
+        self.assertEqual(await self.scheduler.from_string("next"), b"next")
+        self.assertEqual(self.converter.started, ["running", "next"])
+        self.assertEqual(self.scheduler.stats()["running"], 0)
+
+    async def test_render_many(self):
+        jobs = [{"string": str(i), "priority": "interactive"} for i in range(3)]
+        results = [
+            result async for result in self.scheduler.render_many(jobs, ordered=True)
+        ]
+        self.assertEqual([result.pdf for result in results], [b"0", b"1", b"2"])
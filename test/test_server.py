@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+from .common import *
+from pyhtmltopdf import *
+
+
+def request(address, path, job=None):
+    url = f"http://{address[0]}:{address[1]}{path}"
+    data = None if job is None else json.dumps(job).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data)) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+
+
+class TestRenderServer(unittest.IsolatedAsyncioTestCase):
+    async def test_render(self):
+        async with RenderServer(port=0, launch_options=LAUNCH_OPTIONS) as server:
+            status, pdf = await asyncio.to_thread(
+                request,
+                server.address,
+                "/render",
+                {
+                    "string": TEST_HTML,
+                    "header_html": TEST_HEADER,
+                    "footer_html": TEST_FOOTER,
+                    "render_options": {"margin": {"top": "2cm", "bottom": "2cm"}},
+                },
+            )
+            self.assertEqual(status, 200)
+            check_test_pdf(self, pdf)
+
+            status, body = await asyncio.to_thread(
+                request, server.address, "/render", {"file_path": "/etc/hostname"}
+            )
+            self.assertEqual(status, 400)
+            status, body = await asyncio.to_thread(
+                request,
+                server.address,
+                "/render",
+                {"string": TEST_HTML, "base_url": "file:///etc/"},
+            )
+            self.assertEqual(status, 400)
+
+            status, body = await asyncio.to_thread(request, server.address, "/health")
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)["responses"], {"200": 1, "400": 2})
+
+            status, body = await asyncio.to_thread(request, server.address, "/metrics")
+            self.assertIn(b'pyhtmltopdf_events_total{event="render"} 1', body)
+
+    async def test_render_options_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "written-by-client.pdf")
+            async with RenderServer(port=0, launch_options=LAUNCH_OPTIONS) as server:
+                status, body = await asyncio.to_thread(
+                    request,
+                    server.address,
+                    "/render",
+                    {
+                        "string": TEST_HTML,
+                        "render_options": {"path": path},
+                        "optimize_options": {"compress": True},
+                    },
+                )
+                self.assertEqual(status, 400)
+
+                reader, writer = await asyncio.open_connection(*server.address)
+                writer.write(
+                    b"POST /render HTTP/1.1\r\nHost: localhost\r\n"
+                    b"Content-Length: many\r\n\r\n"
+                )
+                await writer.drain()
+                self.assertIn(b" 400 ", await reader.readline())
+                writer.close()
+                await writer.wait_closed()
+            self.assertFalse(os.path.exists(path))
+
+    async def test_queue_full(self):
+        async with RenderServer(
+            port=0,
+            concurrency=1,
+            max_queue_size=0,
+            launch_options=LAUNCH_OPTIONS,
+        ) as server:
+            slow_job = {
+                "string": TEST_HTML,
+                "load_options": {"wait_for_function": "false", "timeout": 1000},
+            }
+            slow = asyncio.ensure_future(
+                asyncio.to_thread(request, server.address, "/render", slow_job)
+            )
+            await asyncio.sleep(0.5)
+            status, body = await asyncio.to_thread(
+                request, server.address, "/render", {"string": TEST_HTML}
+            )
+            self.assertEqual(status, 429)
+            status, body = await slow
+            self.assertEqual(status, 500)
+
+    async def test_queue_full_burst(self):
+        async with RenderServer(
+            port=0,
+            concurrency=1,
+            max_queue_size=1,
+            launch_options=LAUNCH_OPTIONS,
+        ) as server:
+            slow_job = {
+                "string": TEST_HTML,
+                "load_options": {"wait_for_function": "false", "timeout": 1000},
+            }
+            # All requests arrive at once, so only one can run and one wait
+            statuses = await asyncio.gather(
+                *(
+                    asyncio.to_thread(request, server.address, "/render", slow_job)
+                    for i in range(4)
+                )
+            )
+            self.assertEqual(
+                sorted(status for status, body in statuses),
+                [429, 429, 500, 500],
+            )
+            self.assertEqual(server.stats()["queued"], 0)
+            self.assertEqual(server.stats()["running"], 0)
@@ -0,0 +1,53 @@
+import concurrent.futures
+import unittest
+from .common import *
+from pyhtmltopdf import *
+
+
+class TestThreadSafe(unittest.TestCase):
+    def test_from_string(self):
+        with ThreadSafeConverter(LAUNCH_OPTIONS) as converter:
+            pdf = converter.from_string(
+                TEST_HTML,
+                header_html=TEST_HEADER,
+                footer_html=TEST_FOOTER,
+                render_options={
+                    "margin": {
+                        "top": "2cm",
+                        "bottom": "2cm",
+                    },
+                },
+            )
+            check_test_pdf(self, pdf)
+
+    def test_threads(self):
+        def render(i):
+            return converter.from_string(
+                f"<!DOCTYPE html><html><body><h1>PDF {i}</h1></body></html>"
+            )
+
+        with ThreadSafeConverter(LAUNCH_OPTIONS, concurrency=4) as converter:
+            with concurrent.futures.ThreadPoolExecutor(8) as executor:
+                pdfs = list(executor.map(render, range(16)))
+            self.assertEqual(converter.browser_stats()["launches"], 1)
+
+        for i, pdf in enumerate(pdfs):
+            self.assertIn(f"PDF {i}", get_pdf_text(pdf))
+
+    def test_timeout(self):
+        with ThreadSafeConverter(LAUNCH_OPTIONS) as converter:
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                converter.from_string(
+                    TEST_HTML,
+                    load_options={"wait_for_selector": "#missing"},
+                    timeout=0.5,
+                )
+
+            future = converter.submit(
+                {"string": TEST_HTML, "load_options": {"wait_for_selector": "#missing"}}
+            )
+            self.assertTrue(future.cancel())
+
+            # The converter is still usable afterwards
+            pdf = converter.from_string(TEST_HTML)
+            self.assertIn("Test HTML", get_pdf_text(pdf))